@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""Compare round-trip times of engine transports (XML-RPC vs. framed).
+
+XML-RPC is measured over TCP with a new connection per request (like
+the SDK used to do) and with a persistent (keep-alive) connection over
+TCP and over a Unix socket.
+"""
+
+import re
+import os
+import sys
+import socket
+import shutil
+import time
+import httplib
+import tempfile
+import xmlrpclib
+import subprocess
+
+from onlinelab.utils.benchmarking import timed
+from onlinelab.engines.utils.framed import FramedClient
+from onlinelab.engines.python import builder
+
+cases = [
+    ('1+1', "1+1"),
+    ('trivial', "x = 1 + 1"),
+    ('plot', "__plots__ = [{'data': 'A'*%d, 'type': 'image/png', 'encoding': 'base64'}]" % (1 << 20)),
+]
+
+clients = [
+    ('xmlrpc-close', 'xmlrpc', 'tcp'),
+    ('xmlrpc-tcp', 'xmlrpc', 'tcp'),
+    ('xmlrpc', 'xmlrpc', 'unix'),
+    ('framed', 'framed', 'unix'),
+]
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """HTTP connection over a Unix socket. """
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+class UnixTransport(xmlrpclib.Transport):
+    """XML-RPC transport over a (persistent) Unix socket connection. """
+
+    def __init__(self, path):
+        xmlrpclib.Transport.__init__(self)
+        self.path = path
+
+    def make_connection(self, host):
+        if self._connection[1] is None:
+            self._connection = host, UnixHTTPConnection(self.path)
+
+        return self._connection[1]
+
+def start(client, cwd):
+    """Start a Python engine and return a blocking client for it. """
+    transport, family = dict((name, (transport, family)) for name, transport, family in clients)[client]
+
+    if family == 'unix':
+        address = os.path.join(cwd, 'engine.sock')
+    else:
+        address = 0
+
+    command = builder(address, None, transport)
+    command[0] = sys.executable
+
+    # Engine's output goes to a file, because a pipe that nobody reads
+    # would eventually block the engine (e.g. when evaluating '1+1').
+
+    output = os.path.join(cwd, 'engine-%s.out' % client)
+    process = subprocess.Popen(command, cwd=cwd, stdout=open(output, 'w'))
+
+    while 'OK (pid=' not in open(output).read():
+        time.sleep(0.01)
+
+    if address == 0:
+        address = int(re.search(r"port=(\d+)", open(output).read()).group(1))
+
+    url = 'http://localhost:%s' % address
+
+    if client == 'framed':
+        proxy = FramedClient(address)
+        evaluate = lambda source: proxy.call('evaluate', source)
+    elif client == 'xmlrpc':
+        proxy = xmlrpclib.ServerProxy('http://localhost', UnixTransport(address), allow_none=True)
+        evaluate = lambda source: proxy.evaluate(source)
+    elif client == 'xmlrpc-tcp':
+        proxy = xmlrpclib.ServerProxy(url, allow_none=True)
+        evaluate = lambda source: proxy.evaluate(source)
+    else:
+        evaluate = lambda source: xmlrpclib.ServerProxy(url, allow_none=True).evaluate(source)
+
+    return process, evaluate
+
+def main():
+    cwd = tempfile.mkdtemp()
+
+    try:
+        for client in sys.argv[1:] or [ name for name, _, _ in clients ]:
+            process, evaluate = start(client, cwd)
+
+            try:
+                for name, source in cases:
+                    number, _, value, unit = timed(lambda: evaluate(source))
+                    line = u"%-12s %-8s %6d loops, best of 3: %.3g %s per loop" % (client, name, number, value, unit)
+                    print line.encode('utf-8')
+            finally:
+                process.kill()
+                process.wait()
+    finally:
+        shutil.rmtree(cwd)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
 
 from onlinelab.engines.javascript.runtime import JavaScriptEngine
-JavaScriptEngine().run(port=8888, interactive=True)
+JavaScriptEngine().run(address=8888, interactive=True)
 
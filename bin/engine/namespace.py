@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""Compare setup time and memory of eager vs. lazy Python namespaces. """
+
+import sys
+import subprocess
+
+script = """
+import time
+
+def rss():
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+
+before = rss()
+start = time.time()
+
+from onlinelab.engines.python.namespace import PythonNamespace
+namespace = PythonNamespace(disable=[], lazy=%(lazy)s)
+
+print('%%.1f %%d %%d' %% ((time.time() - start)*1000, rss() - before, len(namespace)))
+"""
+
+modes = [
+    ('eager', []),
+    ('lazy', None),
+]
+
+def measure(lazy):
+    """Set up a namespace in a fresh interpreter and return statistics. """
+    output = subprocess.check_output([sys.executable, '-c', script % {'lazy': lazy}])
+    time, rss, names = output.split()
+    return float(time), int(rss), int(names)
+
+def main():
+    for name, lazy in modes:
+        results = [ measure(lazy) for i in range(3) ]
+
+        time = min(result[0] for result in results)
+        rss = min(result[1] for result in results)
+        names = results[0][2]
+
+        print "%-6s %8.1f ms %8d kB RSS %6d names" % (name, time, rss, names)
+
+if __name__ == '__main__':
+    main()
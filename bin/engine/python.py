@@ -1,5 +1,5 @@
 #!/usr/bin/env python
 
 from onlinelab.engines.python.runtime import PythonEngine
-PythonEngine().run(port=8888, interactive=True)
+PythonEngine().run(address=8888, interactive=True)
 
@@ -1,11 +1,21 @@
 """Bootstrap code for a JavaScript engine. """
 
 boot = """\
+import time; started = time.time()
 from onlinelab.engines.javascript.runtime import JavaScriptEngine
-JavaScriptEngine().run(port=%(port)d, code=%(code)r)
+JavaScriptEngine(started=started).run(address=%(address)r, code=%(code)r, transport=%(transport)r)
 """
 
-def builder(port, code):
+def builder(address, code, transport='xmlrpc'):
     """Build command-line for running JavaScript engine. """
-    return ["python", "-c", boot % {'port': port, 'code': code}]
+    return ["python", "-c", boot % {'address': address, 'code': code, 'transport': transport}]
 
+forker = """\
+from onlinelab.engines.utils.zygote import Zygote
+from onlinelab.engines.javascript.runtime import JavaScriptEngine
+Zygote(JavaScriptEngine).serve_forever(path=%(path)r)
+"""
+
+def zygote_builder(path):
+    """Build command-line for running JavaScript fork server. """
+    return ["python", "-c", forker % {'path': path}]
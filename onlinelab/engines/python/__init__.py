@@ -1,11 +1,21 @@
 """Bootstrap code for a Python engine. """
 
 boot = """\
+import time; started = time.time()
 from onlinelab.engines.python.runtime import PythonEngine
-PythonEngine().run(port=%(port)d, code=%(code)r)
+PythonEngine(started=started).run(address=%(address)r, code=%(code)r, transport=%(transport)r)
 """
 
-def builder(port, code):
+def builder(address, code, transport='xmlrpc'):
     """Build command-line for running Python engine. """
-    return ["python", "-c", boot % {'port': port, 'code': code}]
+    return ["python", "-c", boot % {'address': address, 'code': code, 'transport': transport}]
 
+forker = """\
+from onlinelab.engines.utils.zygote import Zygote
+from onlinelab.engines.python.runtime import PythonEngine
+Zygote(PythonEngine).serve_forever(path=%(path)r)
+"""
+
+def zygote_builder(path):
+    """Build command-line for running Python fork server. """
+    return ["python", "-c", forker % {'path': path}]
@@ -0,0 +1,244 @@
+"""Incremental index of names for fast code completion. """
+
+import bisect
+import keyword
+import threading
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+from .namespace import iter_names
+
+try:
+    immutable = (int, long, float, complex, bool, str, unicode, type(None))
+except NameError:
+    immutable = (int, float, complex, bool, str, bytes, type(None))
+
+STORE_OPS = set(['STORE_NAME', 'STORE_GLOBAL', 'DELETE_NAME', 'DELETE_GLOBAL'])
+GLOBAL_OPS = set(['STORE_GLOBAL', 'DELETE_GLOBAL'])
+
+# Code referring to these can modify globals in ways we can't follow.
+UNTRACKABLE = set(['globals', 'vars', 'locals', 'exec', 'execfile', 'eval'])
+
+def get_changes(code):
+    """Find global names that ``code`` may bind or delete.
+
+    Returns a pair of sets: names changed by ``code`` itself (``None``
+    if they can't be determined, e.g. after ``from ... import *``) and
+    names declared ``global`` in functions, which can change later.
+    """
+    names, volatile = set([]), set([])
+
+    for opname, name in iter_names(code):
+        if opname in STORE_OPS:
+            names.add(name)
+
+            if opname in GLOBAL_OPS:
+                volatile.add(name)
+        elif opname in ('IMPORT_STAR', 'EXEC_STMT'):
+            names = None
+        elif name in UNTRACKABLE and opname in ('LOAD_NAME', 'LOAD_GLOBAL'):
+            names = None
+
+        if names is None:
+            break
+
+    return names, volatile
+
+class Keyword(object):
+    """Placeholder for Python keywords in the completion index. """
+
+class CompletionIndex(object):
+    """Sorted index of global names with lazily computed information.
+
+    The index is synchronized with the namespace when completion is
+    requested (not after each evaluation, so evaluation doesn't pay for
+    it). Evaluation only reports names it may have changed (see
+    :meth:`touch`) and only those names are looked up in the namespace.
+    If this can't be tracked or the namespace's size doesn't match the
+    index, the whole namespace is compared with the index. Completions
+    may be requested concurrently, so instead of being modified in
+    place, new versions of ``names`` and ``objects`` are built and
+    swapped in.
+    """
+
+    def __init__(self, inspector):
+        self.inspector = inspector
+
+        self.names = []
+        self.objects = {}
+        self.globals = set([])
+        self.info = {}
+
+        self.changed = None
+        self.volatile = set([])
+
+        self.lock = threading.Lock()
+
+        self.base = dict((name, Keyword) for name in keyword.kwlist)
+        self.base.update(builtins.__dict__)
+
+    def touch(self, names=None, volatile=()):
+        """Record names that may have changed in the global namespace.
+
+        ``None`` means that anything could have changed. Names listed in
+        ``volatile`` can change at any time (e.g. they are declared
+        ``global`` in a function), so they will be checked on each update.
+        """
+        with self.lock:
+            self.volatile.update(volatile)
+
+            if names is None or self.changed is None:
+                self.changed = None
+            else:
+                self.changed.update(names)
+
+    def update(self, namespace):
+        """Synchronize the index with the given global namespace. """
+        with self.lock:
+            changed, self.changed = self.changed, set([])
+
+            if changed is not None:
+                changed |= self.volatile
+                changed.discard('__builtins__')
+
+                self._update_names(namespace, changed)
+
+                size = len(namespace)
+
+                if '__builtins__' in namespace:
+                    size -= 1
+
+                if size == len(self.globals):
+                    return
+
+            self._update(namespace)
+
+    def _update_names(self, namespace, changed):
+        objects = None
+        added, removed = [], []
+
+        for name in changed:
+            try:
+                obj = namespace[name]
+            except KeyError:
+                if name not in self.globals:
+                    continue
+
+                self.globals.discard(name)
+
+                if objects is None:
+                    objects = dict(self.objects)
+
+                if name in self.base:
+                    objects[name] = self.base[name]
+                else:
+                    del objects[name]
+                    removed.append(name)
+            else:
+                self.globals.add(name)
+
+                if name in self.objects and self.objects[name] is obj:
+                    continue
+
+                if objects is None:
+                    objects = dict(self.objects)
+
+                if name not in objects:
+                    added.append(name)
+
+                objects[name] = obj
+
+        if objects is not None:
+            self._swap(objects, added, removed)
+
+    def _update(self, namespace):
+        objects = dict(self.base)
+        objects.update(namespace)
+        objects.pop('__builtins__', None)
+
+        self.globals = set(namespace)
+        self.globals.discard('__builtins__')
+
+        current = self.objects
+
+        added = [ name for name in objects if name not in current ]
+        removed = [ name for name in current if name not in objects ]
+
+        self._swap(objects, added, removed)
+
+    def _swap(self, objects, added, removed):
+        if added or removed:
+            names = list(self.names)
+
+            for name in removed:
+                del names[bisect.bisect_left(names, name)]
+                self.info.pop(name, None)
+
+            if len(added) > len(names):
+                names = sorted(names + added)
+            else:
+                for name in added:
+                    bisect.insort(names, name)
+
+            self.names = names
+
+        self.objects = objects
+
+    def lookup(self, prefix):
+        """Return all names starting with ``prefix``. """
+        names = self.names
+
+        start = bisect.bisect_left(names, prefix)
+        end = start
+
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+
+        return names[start:end]
+
+    def get_info(self, name, obj):
+        """Return basic information about a global object.
+
+        Information is cached only for immutable values and objects like
+        functions, classes and modules, which don't change without being
+        rebound. Other values (e.g. lists) can be modified in place, so
+        their ``repr`` has to be computed each time.
+        """
+        if obj is Keyword:
+            return {'type': 'keyword'}
+
+        try:
+            cached, info = self.info[name]
+        except KeyError:
+            pass
+        else:
+            if cached is obj:
+                return info
+
+        info = self.inspector.get_basic_info(obj)
+
+        if isinstance(obj, immutable) or info['type'] in self.inspector._what_is:
+            self.info[name] = (obj, info)
+
+        return info
+
+    def complete(self, prefix):
+        """Return completions (with information) of a global name. """
+        objects = self.objects
+        completions = []
+
+        for name in self.lookup(prefix):
+            try:
+                obj = objects[name]
+            except KeyError:
+                continue # removed in the meantime
+
+            completions.append({
+                'match': name,
+                'info': self.get_info(name, obj),
+            })
+
+        return completions
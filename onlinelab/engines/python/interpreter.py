@@ -15,6 +15,7 @@ from ..utils.interpreter import Interpreter
 
 from .namespace import PythonNamespace
 from .inspector import Inspector
+from .completion import CompletionIndex, get_changes
 
 class PythonInterpreter(Interpreter):
     """Customized Python interpreter with two-stage evaluation. """
@@ -23,55 +24,43 @@ class PythonInterpreter(Interpreter):
         super(PythonInterpreter, self).__init__(debug)
         self.namespace = PythonNamespace()
         self.inspector = Inspector()
+        self.completions = CompletionIndex(self.inspector)
 
-    def complete(self, source):
-        """Get all completions for an initial source code. """
-        interrupted = False
+    def update_completions(self):
+        """Synchronize completion index with the global namespace. """
+        self.completions.update(self.namespace)
 
-        try:
-            completer = rlcompleter.Completer(self.namespace)
+    def touch_completions(self, codes, names):
+        """Tell completion index which names evaluation may have changed. """
+        names, volatile = set(names), set([])
 
-            matches = set([])
-            state = 0
+        for code in codes:
+            changed, declared = get_changes(code)
+            volatile |= declared
 
-            while True:
-                result = completer.complete(source, state)
-
-                if result is not None:
-                    matches.add(result)
-                    state += 1
-                else:
-                    break
-
-            completions = []
+            if changed is not None and names is not None:
+                names |= changed
+            else:
+                names = None
 
-            for match in sorted(matches):
-                if match[-1] == '(':
-                    match = match[:-1]
+        self.completions.touch(names, volatile)
 
-                if '.' in match:
-                    name, attrs = match.split('.', 1)
-                else:
-                    name, attrs = match, None
+    def complete(self, source):
+        """Get all completions for an initial source code.
 
-                try:
-                    obj = self.namespace[name]
-                except KeyError:
-                    obj = None
-                else:
-                    if attrs is not None:
-                        for attr in attrs.split('.'):
-                            obj = getattr(obj, attr)
+        This runs concurrently with evaluation, so it uses the objects
+        collected by the completion index instead of the live namespace,
+        which may be modified meanwhile.
+        """
+        interrupted = False
 
-                if obj is not None:
-                    info = self.inspector.get_basic_info(obj)
-                else:
-                    info = {'type': 'keyword'}
+        try:
+            self.update_completions()
 
-                completions.append({
-                    'match': match,
-                    'info': info,
-                })
+            if '.' not in source:
+                completions = self.completions.complete(source)
+            else:
+                completions = self.complete_attrs(source)
         except KeyboardInterrupt:
             completions = None
             interrupted = True
@@ -81,6 +70,51 @@ class PythonInterpreter(Interpreter):
             'interrupted': interrupted,
         }
 
+    def complete_attrs(self, source):
+        """Get completions of attributes of a global object. """
+        namespace = self.completions.objects
+        completer = rlcompleter.Completer(namespace)
+
+        matches = set([])
+        state = 0
+
+        while True:
+            result = completer.complete(source, state)
+
+            if result is not None:
+                matches.add(result)
+                state += 1
+            else:
+                break
+
+        completions = []
+
+        for match in sorted(matches):
+            if match[-1] == '(':
+                match = match[:-1]
+
+            name, attrs = match.split('.', 1)
+
+            try:
+                obj = namespace[name]
+            except KeyError:
+                obj = None
+            else:
+                for attr in attrs.split('.'):
+                    obj = getattr(obj, attr)
+
+            if obj is not None:
+                info = self.inspector.get_basic_info(obj)
+            else:
+                info = {'type': 'keyword'}
+
+            completions.append({
+                'match': match,
+                'info': info,
+            })
+
+        return completions
+
     def evaluate(self, source):
         """Evaluate a piece of Python source code. """
         source = source.replace('\r', '').rstrip()
@@ -95,7 +129,7 @@ class PythonInterpreter(Interpreter):
         eval_source += '\n'
 
         try:
-            self.compile(eval_source, 'eval')
+            eval_code = self.compile(eval_source, 'eval')
         except (OverflowError, SyntaxError, ValueError):
             if '\n' not in source and self.is_inspect(source):
                 return self.inspect(source)
@@ -112,6 +146,8 @@ class PythonInterpreter(Interpreter):
         traceback = False
         result = None
 
+        codes = []
+
         start = time.clock()
 
         try:
@@ -122,9 +158,13 @@ class PythonInterpreter(Interpreter):
                     traceback = self.syntaxerror()
                     eval_source = None
                 else:
+                    codes.append(exec_code)
+                    self.namespace.prepare(exec_code)
                     eval(exec_code, self.namespace)
 
             if eval_source is not None:
+                codes.append(eval_code)
+                self.namespace.prepare(eval_code)
                 result = eval(eval_source, self.namespace)
                 sys.displayhook(result)
         except SystemExit:
@@ -151,6 +191,8 @@ class PythonInterpreter(Interpreter):
             self.namespace['__'] = self.namespace.get('_')
             self.namespace['_'] = result
 
+        self.touch_completions(codes, ['__plots__', '_%d' % self.index, '_', '__', '___'])
+
         result = {
             'source': source,
             'index': self.index,
@@ -189,6 +231,8 @@ class PythonInterpreter(Interpreter):
         else:
             name, attrs = text, None
 
+        self.namespace.require(name)
+
         try:
             obj = self.namespace[name]
         except KeyError:
@@ -249,7 +293,10 @@ class PythonInterpreter(Interpreter):
     def execute(self, source):
         """Execute a piece of source code in the global namespace. """
         if source is not None:
-            eval(self.compile(source, 'exec'), self.namespace)
+            code = self.compile(source, 'exec')
+            self.namespace.prepare(code)
+            eval(code, self.namespace)
+            self.completions.touch()
 
     def syntaxerror(self):
         """Return nicely formatted syntax error. """
@@ -1,23 +1,127 @@
 """Customized global namespace for Python interpreter. """
 
+import dis
+import types
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+LOAD_OPS = set(['LOAD_NAME', 'LOAD_GLOBAL'])
+STORE_OPS = set(['STORE_NAME', 'STORE_GLOBAL', 'DELETE_NAME', 'DELETE_GLOBAL'])
+
+def iter_names(code):
+    """Yield ``(opname, name)`` for all instructions referring to names.
+
+    ``exec`` statements (Python 2) are reported as ``('EXEC_STMT', None)``.
+    """
+    if hasattr(dis, 'get_instructions'):
+        for instr in dis.get_instructions(code):
+            if instr.opcode in dis.hasname:
+                yield instr.opname, instr.argval
+    else:
+        bytecode = code.co_code
+        extended = 0
+        i = 0
+
+        while i < len(bytecode):
+            op = ord(bytecode[i])
+
+            if op < dis.HAVE_ARGUMENT:
+                if dis.opname[op] == 'EXEC_STMT':
+                    yield 'EXEC_STMT', None
+
+                i += 1
+                continue
+
+            arg = ord(bytecode[i+1]) + ord(bytecode[i+2])*256 + extended
+            extended = 0
+            i += 3
+
+            if op == dis.EXTENDED_ARG:
+                extended = arg*65536
+            elif op in dis.hasname:
+                yield dis.opname[op], code.co_names[arg]
+
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            for item in iter_names(const):
+                yield item
+
 class PythonNamespace(dict):
-    """Base namespace for Python interpreters. """
+    """Base namespace for Python interpreters.
+
+    Components listed in ``lazy`` (if enabled) are set up only when
+    code that may need them is about to be executed, i.e. when it
+    refers to a global name that is not defined (yet) or imports
+    the component's module. Name lookups in globals bypass dict's
+    methods (and ``__missing__`` would slow down lookups of builtins),
+    so compiled code has to be checked with :meth:`prepare`.
+    """
 
     components = ['sleep', 'matplotlib', 'pylab', 'mplplot']
+    lazy = ['matplotlib', 'pylab']
+
+    def __init__(self, locals={}, disable=['matplotlib', 'pylab'], lazy=None):
+        self.pending = []
 
-    def __init__(self, locals={}, disable=['matplotlib', 'pylab']):
         if locals is not None:
-            self.setup(disable)
+            self.setup(disable, lazy)
             self.update(locals)
 
-    def setup(self, disable):
+    def setup(self, disable, lazy=None):
         """Setup all enabled components in proper order. """
+        if lazy is None:
+            lazy = self.lazy
+
         for component in self.components:
             if component not in disable:
-                namespace = getattr(self, 'setup_' + component)()
-
-                if namespace is not None:
-                    self.update(namespace)
+                if component in lazy:
+                    self.pending.append(component)
+                else:
+                    namespace = getattr(self, 'setup_' + component)()
+
+                    if namespace is not None:
+                        self.update(namespace)
+
+    def resolve(self):
+        """Setup all components that were postponed until first use. """
+        pending, self.pending = self.pending, []
+
+        for component in pending:
+            namespace = getattr(self, 'setup_' + component)()
+
+            if namespace is not None:
+                for name, value in namespace.items():
+                    self.setdefault(name, value)
+
+    def prepare(self, code):
+        """Setup postponed components if ``code`` may need them. """
+        if not self.pending:
+            return
+
+        loads, stores = set([]), set([])
+
+        for opname, name in iter_names(code):
+            if opname == 'IMPORT_NAME':
+                if name.split('.')[0] in self.pending:
+                    self.resolve()
+                    return
+            elif opname in LOAD_OPS:
+                loads.add(name)
+            elif opname in STORE_OPS:
+                stores.add(name)
+
+        for name in loads - stores:
+            if name not in self and not hasattr(builtins, name):
+                self.resolve()
+                return
+
+    def require(self, name):
+        """Setup postponed components if ``name`` isn't defined. """
+        if self.pending and name not in self:
+            self.resolve()
 
     def setup_sleep(self):
         """Add :func:`sleep` to the global namespace. """
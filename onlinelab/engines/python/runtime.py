@@ -2,9 +2,17 @@
 
 from ..utils.runtime import Engine
 from .interpreter import PythonInterpreter
+from .namespace import PythonNamespace
 
 class PythonEngine(Engine):
     """The default Python engine. """
 
     _interpreter = PythonInterpreter
 
+    @classmethod
+    def preload(cls):
+        """Import matplotlib and pylab (if available) ahead of time. """
+        namespace = PythonNamespace(locals=None)
+        namespace.setup_matplotlib()
+        namespace.setup_pylab()
+
@@ -1,11 +1,21 @@
 """Bootstrap code for a Python 3 engine. """
 
 boot = """\
+import time; started = time.time()
 from onlinelab.engines.python3.runtime import Python3Engine
-Python3Engine().run(port=%(port)d, code=%(code)r)
+Python3Engine(started=started).run(address=%(address)r, code=%(code)r, transport=%(transport)r)
 """
 
-def builder(port, code):
+def builder(address, code, transport='xmlrpc'):
     """Build command-line for running Python 3 engine. """
-    return ["python3", "-c", boot % {'port': port, 'code': code}]
+    return ["python3", "-c", boot % {'address': address, 'code': code, 'transport': transport}]
 
+forker = """\
+from onlinelab.engines.utils.zygote import Zygote
+from onlinelab.engines.python3.runtime import Python3Engine
+Zygote(Python3Engine).serve_forever(path=%(path)r)
+"""
+
+def zygote_builder(path):
+    """Build command-line for running Python 3 fork server. """
+    return ["python3", "-c", forker % {'path': path}]
@@ -0,0 +1,117 @@
+"""Execution of evaluation requests in the main thread. """
+
+import os
+import sys
+import errno
+import signal
+import threading
+import collections
+
+class Job(object):
+    """Function call submitted for execution in the main thread. """
+
+    def __init__(self, func, args, callback):
+        self.func = func
+        self.args = args
+        self.callback = callback
+
+    def run(self):
+        """Call the function and pass its result (or error) to a callback. """
+        result, error = None, None
+
+        try:
+            result = self.func(*self.args)
+        except (Exception, KeyboardInterrupt) as exc:
+            error = exc
+
+        self.callback(result, error)
+
+class MainThreadExecutor(object):
+    """Run functions submitted from other threads in the main thread.
+
+    Evaluation has to happen in the main thread, because this is where
+    SIGINT (used for interrupting evaluation) is delivered. Servers
+    read requests in a separate thread, so that they can serve other
+    requests (e.g. completion) while evaluation is in progress.
+
+    SIGINT raises :exc:`KeyboardInterrupt` only while a submitted
+    function is running. Arriving anywhere else (e.g. while a response
+    is being sent), it would break the executor, so it's ignored.
+    """
+
+    def __init__(self):
+        self.jobs = collections.deque()
+        self.rfd, self.wfd = os.pipe()
+
+    def submit(self, func, args, callback):
+        """Schedule ``func(*args)`` and call ``callback(result, error)``. """
+        self.jobs.append(Job(self._interruptible(func), args, callback))
+        os.write(self.wfd, b'.')
+
+    def _interruptible(self, func):
+        """Allow SIGINT to interrupt ``func`` (and nothing else). """
+        def wrapper(*args):
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+            try:
+                return func(*args)
+            finally:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        return wrapper
+
+    def call(self, func, *args):
+        """Run ``func(*args)`` in the main thread and wait for its result. """
+        done = threading.Event()
+        outcome = []
+
+        def callback(result, error):
+            outcome.extend([result, error])
+            done.set()
+
+        self.submit(func, args, callback)
+        done.wait()
+
+        result, error = outcome
+
+        if error is not None:
+            raise error
+        else:
+            return result
+
+    def run_forever(self, interactive=False):
+        """Indefinitely run jobs submitted by other threads. """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        while True:
+            try:
+                if interactive:
+                    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+                os.read(self.rfd, 1)
+            except KeyboardInterrupt:
+                # Note that we use SIGINT for interrupting evaluation in the
+                # underlying interpreter instance, so in 'interactive' mode
+                # you will need to send two SIGINTs to the process (one to
+                # interrupt currently evaluating code and one to stop the
+                # RPC server) to terminate it.
+                if interactive:
+                    sys.stdout.write("\nTerminated (interactive mode)\n")
+                    break
+                else:
+                    continue
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                raise
+            finally:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            self.jobs.popleft().run()
+
+def start_thread(target, *args):
+    """Run ``target(*args)`` in a daemon thread. """
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,174 @@
+"""Length-prefixed JSON frames based communication layer. """
+
+import os
+import json
+import errno
+import struct
+import socket
+import threading
+
+from .server import EngineXMLRPCMethods
+from .executor import Job, MainThreadExecutor, start_thread
+
+HEADER = struct.Struct('!I')
+
+def encode_frame(obj):
+    """Serialize ``obj`` as a frame (4 byte length + UTF-8 JSON). """
+    data = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+def decode_frame(data):
+    """Deserialize payload of a frame (without the length prefix). """
+    return json.loads(data.decode('utf-8'))
+
+class FrameReader(object):
+    """Incrementally read frames from a blocking socket.
+
+    Data received so far is kept between calls, so that a signal (e.g.
+    SIGINT used for interrupting evaluation) arriving in the middle of
+    a frame doesn't corrupt the stream.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+
+    def _fill(self, size):
+        while len(self.buffer) < size:
+            data = self.sock.recv(max(size - len(self.buffer), 65536))
+
+            if not data:
+                raise EOFError
+
+            self.buffer += data
+
+    def read(self):
+        """Read and decode the next frame. """
+        self._fill(HEADER.size)
+        size, = HEADER.unpack(self.buffer[:HEADER.size])
+        self._fill(HEADER.size + size)
+
+        data = self.buffer[HEADER.size:HEADER.size+size]
+        self.buffer = self.buffer[HEADER.size+size:]
+
+        return decode_frame(data)
+
+class FramedClient(object):
+    """Simple blocking client for framed engine servers. """
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.reader = FrameReader(self.sock)
+        self.id = 0
+
+    def call(self, method, *params):
+        """Call ``method`` on the server and wait for the result. """
+        self.id += 1
+        self.sock.sendall(encode_frame({'id': self.id, 'method': method, 'params': params}))
+
+        response = self.reader.read()
+
+        if response.get('error') is not None:
+            raise RuntimeError(response['error'])
+        else:
+            return response['result']
+
+    def close(self):
+        """Close connection to the server. """
+        self.sock.close()
+
+class EngineFramedServer(object):
+    """Framed protocol server for handling requests from a service.
+
+    Frames are read in a separate thread. Methods listed in
+    ``_concurrent`` are served right there (even when evaluation is
+    in progress), all others are run in the main thread. Responses
+    are matched with requests by ``id``, so they may be out of order.
+    """
+
+    _methods = EngineXMLRPCMethods
+    _concurrent = ['complete', 'skip']
+
+    def __init__(self, path, interpreter):
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self.path = path
+        self.port = None
+        self.methods = self._methods(interpreter)
+
+        self.executor = MainThreadExecutor()
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(1)
+
+    def dispatch(self, request):
+        """Call a method requested in a frame and build a response. """
+        response = {'id': request.get('id'), 'result': None, 'error': None}
+
+        method = request.get('method')
+
+        if method not in ['complete', 'evaluate', 'evaluate_batch', 'skip']:
+            response['error'] = "method '%s' is not supported" % method
+        else:
+            response['result'] = getattr(self.methods, method)(*request.get('params', []))
+
+        return response
+
+    def handle_connection(self, conn):
+        """Serve frames from a single connection until it's closed. """
+        reader = FrameReader(conn)
+        lock = threading.Lock()
+
+        def send(response):
+            with lock:
+                try:
+                    conn.sendall(encode_frame(response))
+                except socket.error:
+                    pass # service will notice that connection was closed
+
+        def respond(request):
+            def callback(response, error):
+                if error is not None:
+                    response = {'id': request.get('id'), 'result': None, 'error': repr(error)}
+
+                send(response)
+
+            return callback
+
+        while True:
+            try:
+                request = reader.read()
+            except EOFError:
+                break
+            except socket.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                break
+
+            if request.get('method') in self._concurrent:
+                Job(self.dispatch, (request,), respond(request)).run()
+            else:
+                self.executor.submit(self.dispatch, (request,), respond(request))
+
+    def _serve(self):
+        """Accept and serve connections one at a time. """
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except socket.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            try:
+                self.handle_connection(conn)
+            finally:
+                conn.close()
+
+    def serve_forever(self, interactive=False):
+        """Indefinitely serve requests on persistent connections. """
+        start_thread(self._serve)
+        self.executor.run_forever(interactive)
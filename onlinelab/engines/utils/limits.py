@@ -0,0 +1,41 @@
+"""Resource limits applied to engine processes before they start. """
+
+import os
+import resource
+
+rlimits = {
+    'cpu_time': resource.RLIMIT_CPU,
+    'address_space': resource.RLIMIT_AS,
+    'open_files': resource.RLIMIT_NOFILE,
+    'file_size': resource.RLIMIT_FSIZE,
+    'processes': resource.RLIMIT_NPROC,
+}
+
+# Exceeding soft CPU time limit delivers SIGXCPU, which terminates the
+# process. If it is ignored, SIGKILL follows after this many seconds.
+CPU_TIME_GRACE = 5
+
+def apply_limits(spec):
+    """Apply limits described by ``spec`` to the current process.
+
+    ``spec`` is a dict with ``rlimits`` (mapping of names from
+    :data:`rlimits` to values) and ``cgroup`` (path to a cgroup v2
+    directory prepared by the service, or ``None``). This has to be
+    called in a child process, before engine's code runs.
+    """
+    if not spec:
+        return
+
+    for name, value in spec.get('rlimits', {}).items():
+        soft, hard = value, value
+
+        if name == 'cpu_time':
+            hard += CPU_TIME_GRACE
+
+        resource.setrlimit(rlimits[name], (soft, hard))
+
+    cgroup = spec.get('cgroup')
+
+    if cgroup is not None:
+        with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as procs:
+            procs.write('%d\n' % os.getpid())
@@ -2,8 +2,11 @@
 
 import os
 import sys
+import time
+import json
 
 from .server import EngineXMLRPCServer
+from .framed import EngineFramedServer
 
 class Stream(object):
     """Emulate unbuffered UTF-8 encoded stream. """
@@ -27,30 +30,64 @@ class Stream(object):
 class Engine(object):
     """Base class for Python-managed engines. """
 
-    _transport = EngineXMLRPCServer
+    _transports = {
+        'xmlrpc': EngineXMLRPCServer,
+        'framed': EngineFramedServer,
+    }
+
     _interpreter = None
 
-    def __init__(self, interpreter=None):
+    def __init__(self, interpreter=None, started=None):
+        imported = time.time()
+
+        if started is None:
+            started = imported
+
         if interpreter is None:
             self.interpreter = self._interpreter()
         else:
             self.interpreter = interpreter
 
+        self.profile = {
+            'started': started,
+            'imports': imported - started,
+            'namespace': time.time() - imported,
+        }
+
+    @classmethod
+    def preload(cls):
+        """Import modules worth sharing between forked engines. """
+
     def setup_io(self):
         """Redefine stdout and stderr for our purpose. """
         sys.stdout = Stream(sys.stdout)
         sys.stderr = Stream(sys.stderr)
 
-    def notify_ready(self):
-        """Notify a service that an engine is running. """
-        sys.stdout.write('OK (pid=%s)\n' % os.getpid())
+    def notify_ready(self, port=None):
+        """Notify a service that an engine is running (with startup profile). """
+        if port is None:
+            status = 'pid=%s' % os.getpid()
+        else:
+            status = 'pid=%s, port=%s' % (os.getpid(), port)
+
+        sys.stdout.write('OK (%s) %s\n' % (status, json.dumps(self.profile)))
         sys.stdout.flush()
 
-    def run(self, port, code=None, interactive=False):
-        """Run a Python engine on the given port. """
-        server = self._transport(port, self.interpreter)
+    def run(self, address, code=None, interactive=False, transport='xmlrpc'):
+        """Run a Python engine on the given address (port or path).
+
+        If ``address`` is port 0, the engine listens on any free port
+        and reports it to the service on the 'OK' line.
+        """
+        start = time.time()
+        server = self._transports[transport](address, self.interpreter)
+        self.profile['server'] = time.time() - start
+
+        start = time.time()
         self.interpreter.execute(code)
-        self.notify_ready()
+        self.profile['code'] = time.time() - start
+
+        self.notify_ready(server.port)
         self.setup_io()
         server.serve_forever(interactive)
 
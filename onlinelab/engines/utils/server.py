@@ -1,11 +1,83 @@
 """XML-RPC based communication layer. """
 
+import os
 import sys
+import socket
+import threading
 
 try:
-    from SimpleXMLRPCServer import SimpleXMLRPCServer
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from SocketServer import ThreadingMixIn
 except ImportError:
-    from xmlrpc.server import SimpleXMLRPCServer
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from socketserver import ThreadingMixIn
+
+from .executor import MainThreadExecutor, start_thread
+
+class OutputCapture(object):
+    """Collect output written to ``stdout`` or ``stderr``.
+
+    Only the first ``max_size`` bytes are kept in memory. Once more is
+    written, everything goes to a file at ``path`` instead, from which
+    the service can read the full output.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        self.path = path
+        self.max_size = max_size
+
+        self.data = []
+        self.file = None
+        self.size = 0
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        self.size += len(data)
+
+        if self.file is None:
+            if self.max_size is None or self.path is None or self.size <= self.max_size:
+                self.data.append(data)
+                return
+
+            directory = os.path.dirname(self.path)
+
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+            kept = b''.join(self.data)
+
+            self.file = open(self.path, 'wb')
+            self.file.write(kept)
+
+            self.data = [kept, data[:self.max_size - len(kept)]]
+
+        self.file.write(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        value = b''.join(self.data)
+
+        if self.file is not None:
+            # Don't end truncated output with a part of a character.
+            for end in range(len(value), max(len(value) - 4, -1), -1):
+                try:
+                    return value[:end].decode('utf-8')
+                except UnicodeDecodeError:
+                    pass
+
+        return value.decode('utf-8', 'replace')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
 
 class EngineXMLRPCMethods(object):
     """Translation layer between engine API and an interpreter. """
@@ -13,6 +85,11 @@ class EngineXMLRPCMethods(object):
     def __init__(self, interpreter):
         self.interpreter = interpreter
 
+        self.lock = threading.Lock()
+        self.current = None
+        self.skipped = set()
+        self.skip_rest = False
+
     def complete(self, source):
         """Complete a piece of source code. """
         return self.interpreter.complete(source)
@@ -21,32 +98,154 @@ class EngineXMLRPCMethods(object):
         """Evaluate a piece of source code. """
         return self.interpreter.evaluate(source)
 
-class EngineXMLRPCServer(SimpleXMLRPCServer):
-    """XML-RPC server for handling requests from a service. """
+    def evaluate_batch(self, batch):
+        """Evaluate several pieces of source code in one request.
+
+        ``batch`` is a dict with ``sources`` and optionally ``outputs``
+        (pairs of paths for spilling ``stdout`` and ``stderr`` of each
+        piece) and ``limit`` (number of bytes of output to return). Output
+        of each piece is captured separately and returned in its result.
+        Pieces that were skipped (see :meth:`skip`) are reported as
+        interrupted.
+        """
+        sources = batch['sources']
+        outputs = batch.get('outputs') or [(None, None)]*len(sources)
+        limit = batch.get('limit')
+
+        results = []
+
+        with self.lock:
+            self.current, self.skipped, self.skip_rest = 0, set(), False
+
+        try:
+            for i, source in enumerate(sources):
+                with self.lock:
+                    self.current = i
+                    skipped = self.skip_rest or i in self.skipped
+
+                if skipped:
+                    results.append({
+                        'source': source,
+                        'index': None,
+                        'time': 0,
+                        'out': u'',
+                        'err': u'',
+                        'plots': [],
+                        'traceback': False,
+                        'interrupted': True,
+                    })
+                    continue
+
+                out_path, err_path = outputs[i]
+
+                stdout, sys.stdout = sys.stdout, OutputCapture(out_path, limit)
+                stderr, sys.stderr = sys.stderr, OutputCapture(err_path, limit)
+
+                try:
+                    result = self.interpreter.evaluate(source)
+                finally:
+                    out, sys.stdout = sys.stdout, stdout
+                    err, sys.stderr = sys.stderr, stderr
+
+                    out.close()
+                    err.close()
+
+                result['out'] = out.getvalue()
+                result['err'] = err.getvalue()
+
+                if out.spilled or err.spilled:
+                    result['spilled'] = {'out': out.size, 'err': err.size}
+
+                results.append(result)
+        finally:
+            with self.lock:
+                self.current = None
+
+        return results
+
+    def skip(self, index):
+        """Don't evaluate a piece of the current batch (or all remaining).
+
+        Returns ``'skipped'`` if the piece (``-1`` means all pieces after
+        the current one) won't be evaluated, ``'running'`` if it is being
+        evaluated right now and ``'done'`` otherwise.
+        """
+        with self.lock:
+            if self.current is None:
+                return 'done'
+
+            if index < 0:
+                self.skip_rest = True
+                return 'skipped'
+
+            if index < self.current:
+                return 'done'
+            elif index == self.current:
+                return 'running'
+            else:
+                self.skipped.add(index)
+                return 'skipped'
+
+class EngineXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    """Serve multiple requests per connection (HTTP/1.1 keep-alive). """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """Disable Nagle's algorithm (only applies to TCP). """
+        self.disable_nagle_algorithm = self.server.address_family == socket.AF_INET
+        SimpleXMLRPCRequestHandler.setup(self)
+
+    def address_string(self):
+        """Unix sockets don't have client addresses. """
+        return 'localhost'
+
+class EngineXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """XML-RPC server for handling requests from a service.
+
+    Each request is handled in its own thread. Methods listed in
+    ``_concurrent`` are served right there (even when evaluation is
+    in progress), all others are run in the main thread.
+    """
 
     _methods = EngineXMLRPCMethods
+    _concurrent = ['complete', 'skip']
+
+    daemon_threads = True
+
+    def __init__(self, address, interpreter):
+        """Listen on a Unix socket (path) or TCP port (0 means any). """
+        if isinstance(address, int):
+            address = ('localhost', address)
+        else:
+            self.address_family = socket.AF_UNIX
 
-    def __init__(self, port, interpreter):
-        address = ('localhost', port)
+            if os.path.exists(address):
+                os.unlink(address)
 
         SimpleXMLRPCServer.__init__(self, address,
+            requestHandler=EngineXMLRPCRequestHandler,
             logRequests=False, allow_none=True)
 
+        if self.address_family == socket.AF_INET:
+            self.port = self.server_address[1]
+        else:
+            self.port = None
+
+        self.executor = MainThreadExecutor()
+
         self.register_instance(self._methods(interpreter))
         self.register_introspection_functions()
 
+    def _dispatch(self, method, params):
+        """Run a method in this thread or in the main thread. """
+        if method in self._concurrent:
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+        else:
+            return self.executor.call(SimpleXMLRPCServer._dispatch, self, method, params)
+
     def serve_forever(self, interactive=False):
         """Indefinitely serve XML RPC requests. """
-        while True:
-            try:
-                self.handle_request()
-            except KeyboardInterrupt:
-                # Note that we use SIGINT for interrupting evaluation in the
-                # underlying interpreter instance, so in 'interactive' mode
-                # you will need to send two SIGINTs to the process (one to
-                # interrupt currently evaluating code and one to stop the
-                # RPC server) to terminate it.
-                if interactive:
-                    sys.stdout.write("\nTerminated (interactive mode)\n")
-                    break
+        start_thread(SimpleXMLRPCServer.serve_forever, self)
+        self.executor.run_forever(interactive)
 
@@ -0,0 +1,147 @@
+"""Fork server for spawning engines with preloaded state. """
+
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import traceback
+
+from .limits import apply_limits
+
+class Zygote(object):
+    """Long-lived process that forks pre-initialized engines.
+
+    The zygote imports an engine and its heavy modules once, then
+    listens on a Unix socket for spawn requests. Each request is a
+    single line of JSON with engine's working directory, environment,
+    resource limits, paths to ``stdout``/``stderr`` FIFOs and arguments
+    to engine's :meth:`run`. The zygote replies with a line containing
+    child's PID. Children are reaped by the zygote, which reports their
+    exit statuses on ``stdout`` (in :class:`subprocess.Popen` format).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.socket = None
+
+    def setup(self):
+        """Import heavy modules before any child is forked. """
+        self.engine.preload()
+
+    def notify_ready(self):
+        """Notify a service that the zygote is running. """
+        os.write(1, ('OK (pid=%d)\n' % os.getpid()).encode('ascii'))
+
+    def reap(self, signum, frame):
+        """Collect and report exit statuses of finished children. """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+
+            if not pid:
+                break
+
+            if os.WIFSIGNALED(status):
+                code = -os.WTERMSIG(status)
+            else:
+                code = os.WEXITSTATUS(status)
+
+            # A single write(2) to a pipe is atomic, even in a signal handler.
+            os.write(1, ('EXIT (pid=%d, code=%d)\n' % (pid, code)).encode('ascii'))
+
+    def serve_forever(self, path):
+        """Indefinitely serve spawn requests on a Unix socket. """
+        self.setup()
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(16)
+
+        signal.signal(signal.SIGCHLD, self.reap)
+
+        self.notify_ready()
+
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except socket.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            try:
+                self.handle(conn)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                conn.close()
+
+    def handle(self, conn):
+        """Process a single spawn request. """
+        stream = conn.makefile('rb')
+
+        try:
+            request = json.loads(stream.readline().decode('utf-8'))
+        finally:
+            stream.close()
+
+        # Open FIFOs here, so that the service never sees them without
+        # a writer (which would look like a dead engine to the IOLoop).
+        stdout = os.open(request['stdout'], os.O_WRONLY)
+        stderr = os.open(request['stderr'], os.O_WRONLY)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        try:
+            pid = os.fork()
+
+            if not pid:
+                conn.close()
+                self.child(request, stdout, stderr)
+        finally:
+            os.close(stdout)
+            os.close(stderr)
+
+        reply = json.dumps({'pid': pid}) + '\n'
+        conn.sendall(reply.encode('utf-8'))
+
+    def child(self, request, stdout, stderr):
+        """Turn a freshly forked child into an engine. """
+        try:
+            os.setsid()
+
+            self.socket.close()
+
+            apply_limits(request.get('limits'))
+
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+            null = os.open(os.devnull, os.O_RDONLY)
+
+            os.dup2(null, 0)
+            os.dup2(stdout, 1)
+            os.dup2(stderr, 2)
+
+            os.close(null)
+
+            os.chdir(request['cwd'])
+
+            os.environ.clear()
+            os.environ.update(request['env'])
+
+            self.engine().run(**request['run'])
+        except SystemExit:
+            pass
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(1)
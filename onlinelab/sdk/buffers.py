@@ -0,0 +1,107 @@
+"""Bounded buffers for engine output. """
+
+import os
+
+from StringIO import StringIO
+
+def utf8_boundary(data):
+    """Return length of the longest prefix of ``data`` not ending in a split character. """
+    end = len(data)
+
+    for i in xrange(1, min(4, end) + 1):
+        byte = ord(data[end - i])
+
+        if byte & 0xC0 == 0x80:
+            continue # continuation byte, look further back
+        elif byte & 0xC0 == 0xC0:
+            if byte >= 0xF0:
+                length = 4
+            elif byte >= 0xE0:
+                length = 3
+            else:
+                length = 2
+
+            if i < length:
+                return end - i
+
+        break
+
+    return end
+
+class OutputBuffer(object):
+    """String buffer that spills to a file above ``max_size`` bytes.
+
+    Only the first ``max_size`` bytes are kept in memory. Everything
+    (including those bytes) goes to the file at ``path`` once the
+    limit is exceeded, so that the full output can be read later.
+    """
+
+    marker = u"\n[... output truncated: %d bytes in total ...]\n"
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+        self.memory = StringIO()
+        self.file = None
+        self.size = 0
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def write(self, data):
+        """Append ``data`` to memory or (after spilling) to a file. """
+        self.size += len(data)
+
+        if self.file is None:
+            if self.size <= self.max_size:
+                self.memory.write(data)
+                return
+
+            directory = os.path.dirname(self.path)
+
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+            self.file = open(self.path, 'wb')
+            self.file.write(self.memory.getvalue())
+
+            self.memory.write(data[:self.max_size - self.memory.tell()])
+
+        self.file.write(data)
+
+    def getvalue(self):
+        """Return buffered output, truncated with a marker if spilled. """
+        value = self.memory.getvalue()
+
+        if self.file is None:
+            return value
+        else:
+            value = value[:utf8_boundary(value)].decode('utf-8', 'replace')
+            return value + self.marker % self.size
+
+    def close(self):
+        """Release memory and close the spill file (which is kept). """
+        self.memory.close()
+
+        if self.file is not None:
+            self.file.close()
+
+def read_output(path, offset, size):
+    """Read a page of spilled output starting at ``offset`` bytes. """
+    with open(path, 'rb') as file:
+        total = os.fstat(file.fileno()).st_size
+
+        file.seek(offset)
+        data = file.read(size)
+
+    if offset + len(data) < total:
+        data = data[:utf8_boundary(data)]
+
+    return {
+        'data': data.decode('utf-8', 'replace'),
+        'offset': offset,
+        'next': offset + len(data),
+        'size': total,
+    }
@@ -0,0 +1,34 @@
+"""Helpers for efficient database access across Django versions. """
+
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    from django.db.transaction import commit_on_success as atomic
+
+MAX_BATCH = 500
+
+def batches(items, size=MAX_BATCH):
+    """Split ``items`` into lists of at most ``size`` elements.
+
+    Some databases (e.g. SQLite) limit the number of parameters of a
+    query, so long ``IN`` lists have to be split.
+    """
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+def bulk_create(model, objects):
+    """Insert ``objects`` with as few queries as Django allows. """
+    if not objects:
+        return
+
+    if hasattr(model.objects, 'bulk_create'):
+        for batch in batches(objects):
+            model.objects.bulk_create(batch)
+    else:
+        for obj in objects:
+            obj.save(force_insert=True)
+
+def bulk_delete(model, pks):
+    """Delete objects of ``model`` with the given primary keys. """
+    for batch in batches(pks):
+        model.objects.filter(pk__in=batch).delete()
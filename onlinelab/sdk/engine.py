@@ -1,24 +1,56 @@
 """Implementation of engine processes. """
 
+import os
 import time
 import signal
 import logging
-import xmlrpclib
 import collections
 
-from StringIO import StringIO
-
 from tornado.ioloop import IOLoop
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest
-from tornado.httputil import HTTPHeaders
 
 import psutil
 
 from .base import EngineBase
-from . import utilities, highlight
+from .streams import OutputStream
+from .buffers import OutputBuffer, read_output
+from .workers import RenderPool
 
 from ..utils.settings import Settings
 
+class Request(object):
+    """Evaluation request waiting for an engine. """
+
+    def __init__(self, method, args, okay, fail):
+        self.method = method
+        self.args = args
+        self.okay = okay
+        self.fail = fail
+        self.queued = time.time()
+
+    @property
+    def is_inspect(self):
+        """Return ``True`` if this is a request for code inspection. """
+        source = self.args.source.strip()
+        return '\n' not in source and (source.startswith('?') or source.endswith('?'))
+
+    @property
+    def is_batchable(self):
+        """Return ``True`` if this request can be evaluated in a batch. """
+        return self.method == 'evaluate' and self.args.get('stream') is None
+
+    def interrupted(self):
+        """Build a result for a request that was never evaluated. """
+        return {
+            'source': self.args.source,
+            'index': None,
+            'time': 0,
+            'out': u'',
+            'err': u'',
+            'plots': [],
+            'traceback': False,
+            'interrupted': True,
+        }
+
 class EngineProcess(EngineBase):
     """Bridge between a logical engine and a physical process. """
 
@@ -26,7 +58,13 @@ class EngineProcess(EngineBase):
     TERMINATING = 2
     DIED = 3
 
-    def __init__(self, manager, uuid, process, cwd, port):
+    MAX_FINISHED_STREAMS = 16
+    MAX_SPILLED_OUTPUTS = 16
+
+    # How long to wait for exit of an engine after losing connection.
+    LOST_TIMEOUT = 2
+
+    def __init__(self, manager, uuid, process, cwd, transport, limits=None):
         """Initialize an engine based on existing system process. """
         self.settings = Settings.instance()
         self.ioloop = IOLoop.instance()
@@ -35,19 +73,37 @@ class EngineProcess(EngineBase):
         self.uuid = uuid
         self.process = process
         self.cwd = cwd
-        self.port = port
+        self.transport = transport
+        self.limits = limits
 
         self.status = self.READY
+        self.reason = None
+        self.last_used = time.time()
 
         self.util = psutil.Process(process.pid)
         self.queue = collections.deque()
-        self.url = "http://localhost:%s" % port
+        self.priority = collections.deque()
+
+        self.waits = 0
+        self.wait_time = 0.0
+        self.wait_max = 0.0
 
         self.evaluating = False
         self.evaluate_timeout = None
 
-        self.out = StringIO()
-        self.err = StringIO()
+        self.lost = []
+        self.lost_timeout = None
+
+        self.next_output_id = 0
+        self.output_id = self._new_output_id()
+        self.spilled_outputs = collections.deque()
+
+        self.out = self._new_buffer('out')
+        self.err = self._new_buffer('err')
+
+        self.current_stream = None
+        self.streams = {}
+        self.finished_streams = collections.deque()
 
         stdout = process.stdout.fileno()
         stderr = process.stderr.fileno()
@@ -69,47 +125,118 @@ class EngineProcess(EngineBase):
     def is_dead(self):
         return self.status == self.DIED
 
+    def _output_path(self, id, type):
+        """Return path to a file with spilled output of a request. """
+        return os.path.join(self.cwd, '.output', '%d.%s' % (id, type))
+
+    def _new_output_id(self):
+        """Allocate an identifier for (possibly spilled) output. """
+        id, self.next_output_id = self.next_output_id, self.next_output_id + 1
+        return id
+
+    def _add_spilled(self, id):
+        """Remember spilled output and remove files of old outputs. """
+        self.spilled_outputs.append(id)
+
+        while len(self.spilled_outputs) > self.MAX_SPILLED_OUTPUTS:
+            id = self.spilled_outputs.popleft()
+
+            for type in ['out', 'err']:
+                try:
+                    os.unlink(self._output_path(id, type))
+                except OSError:
+                    pass
+
+    def _new_buffer(self, type):
+        """Create a bounded buffer for ``stdout`` or ``stderr``. """
+        path = self._output_path(self.output_id, type)
+        return OutputBuffer(path, self.settings.output_buffer_size)
+
     def _reset_io(self):
         """Close and recreate local ``stdout`` and ``stderr``. """
         self.out.close()
-        self.out = StringIO()
-
         self.err.close()
-        self.err = StringIO()
 
-    def _read_stdout(self):
-        """Transfer ``stdout`` from a PIPE to a string buffer. """
+        if self.out.spilled or self.err.spilled:
+            self._add_spilled(self.output_id)
+
+        self.output_id = self._new_output_id()
+
+        self.out = self._new_buffer('out')
+        self.err = self._new_buffer('err')
+
+    def _read_pipe(self, pipe, type):
+        """Transfer data from a PIPE to a string buffer or a stream. """
         while True:
             try:
-                data = self.process.stdout.read()
-                self.out.write(data)
+                data = pipe.read()
             except IOError:
                 break
 
+            if not data:
+                break
+
+            if self.current_stream is not None:
+                self.current_stream.write(type, data)
+            else:
+                getattr(self, type).write(data)
+
+    def _read_stdout(self):
+        """Transfer ``stdout`` from a PIPE to a string buffer. """
+        self._read_pipe(self.process.stdout, 'out')
+
     def _read_stderr(self):
         """Transfer ``stderr`` from a PIPE to a string buffer. """
-        while True:
-            try:
-                data = self.process.stderr.read()
-                self.err.write(data)
-            except IOError:
-                break
+        self._read_pipe(self.process.stderr, 'err')
+
+    def _new_stream(self, id):
+        """Create an output stream for an evaluation request. """
+        try:
+            self.finished_streams.remove(id)
+        except ValueError:
+            pass
+
+        stream = self.streams[id] = OutputStream(id, self.settings.stream_buffer_size)
+        return stream
+
+    def _finish_stream(self, stream):
+        """Mark a stream as complete and forget old streams. """
+        stream.finish()
+
+        self.finished_streams.append(stream.id)
+
+        while len(self.finished_streams) > self.MAX_FINISHED_STREAMS:
+            del self.streams[self.finished_streams.popleft()]
 
     def _on_stdout(self, fd, events):
         """Monitor engine's ``stdout``. """
         if events & self.ioloop.ERROR:
             self.ioloop.remove_handler(fd)
+            self.transport.close()
 
             self.cleanup_process()
             self.process.wait()
 
+            if self.limits is not None:
+                self.reason = self.limits.get_reason(self.process.returncode)
+                self.limits.cleanup()
+
             if self.status == self.TERMINATING:
                 logging.info('%s terminated' % self.uuid)
+                self._fail_lost(self.reason or 'terminated')
                 self.okay('terminated')
                 self.del_process()
             else:
-                logging.info('%s died' % self.uuid)
+                if self.reason is not None:
+                    logging.info('%s died (%s exceeded)' % (self.uuid, self.reason))
+                else:
+                    logging.info('%s died (code=%s)' % (self.uuid, self.process.returncode))
+
                 self.status = self.DIED
+                self._fail_lost(self.reason or 'died')
+
+            for stream in self.streams.values():
+                stream.finish()
         else:
             self._read_stdout()
 
@@ -130,7 +257,15 @@ class EngineProcess(EngineBase):
 
     @property
     def is_evaluating(self):
-        return self.evaluating
+        return bool(self.evaluating)
+
+    @property
+    def is_idle(self):
+        return self.status == self.READY and not (self.evaluating or self.queue or self.priority)
+
+    def touch(self):
+        """Mark this engine as recently used. """
+        self.last_used = time.time()
 
     def stop(self, args, okay, fail):
         """Terminate this engine's process. """
@@ -163,26 +298,90 @@ class EngineProcess(EngineBase):
             'memory': { 'percent': memory_percent, 'rss': rss, 'vms': vms },
         }
 
+    def get_queue_stat(self):
+        """Get statistics of this engine's evaluation queue. """
+        now = time.time()
+
+        oldest = [ queue[0].queued for queue in [self.queue, self.priority] if queue ]
+
+        if oldest:
+            waiting = now - min(oldest)
+        else:
+            waiting = 0.0
+
+        if self.waits:
+            mean = self.wait_time/self.waits
+        else:
+            mean = 0.0
+
+        return {
+            'depth': len(self.queue),
+            'priority': len(self.priority),
+            'evaluating': len(self.evaluating or []),
+            'waiting': waiting,
+            'wait': { 'count': self.waits, 'mean': mean, 'max': self.wait_max },
+        }
+
     def get_memory(self):
         return self.util.get_memory_info()[0]
 
     def stat(self, args, okay, fail):
         """Gather data about this engine's process. """
-        okay(self.get_stat())
+        stat = self.get_stat()
+        stat['queue'] = self.get_queue_stat()
+        okay(stat)
 
     def complete(self, args, okay, fail):
-        """Complete code in this engine's process. """
-        if self.evaluating:
-            fail('busy')
-        else:
-            self._schedule(args, okay, fail)
-            self._evaluate(method='complete')
+        """Complete code in this engine's process.
+
+        Engines serve completion requests concurrently with evaluation,
+        so they don't have to wait in the queue.
+        """
+        self.transport.call('complete', args.source, okay, fail)
 
     def evaluate(self, args, okay, fail):
         """Evaluate code in this engine's process. """
-        self._schedule(args, okay, fail)
+        if args.get('stream') is not None:
+            self._new_stream(args.stream)
+
+        self._schedule(Request('evaluate', args, okay, fail))
         self._evaluate()
 
+    def stream(self, args, okay, fail):
+        """Wait for output of a streamed evaluation request. """
+        try:
+            stream = self.streams[args.stream]
+        except KeyError:
+            fail('no-such-stream')
+        else:
+            stream.wait(args.seq, okay, self.settings.stream_timeout)
+
+    def output(self, args, okay, fail):
+        """Read a page of full (spilled) output of a request. """
+        if args.type not in ['out', 'err']:
+            fail('bad-type')
+            return
+
+        size = self.settings.output_buffer_size
+
+        try:
+            id, offset = int(args.output), int(args.offset)
+
+            if args.size is not None:
+                size = min(int(args.size), size)
+        except (TypeError, ValueError):
+            fail('bad-output')
+            return
+
+        if size <= 0 or offset < 0:
+            fail('bad-output')
+            return
+
+        try:
+            okay(read_output(self._output_path(id, args.type), offset, size))
+        except IOError:
+            fail('no-such-output')
+
     def interrupt(self, args, okay, fail):
         """Stop evaluation of a particular request or all requests. """
         if not self.evaluating:
@@ -194,27 +393,36 @@ class EngineProcess(EngineBase):
         except KeyError:
             pass
         else:
-            _args, _, _ = self.evaluating
+            cellids = [ request.args.get('cellid') for request in self.evaluating ]
 
-            if cellid != _args.cellid:
-                for i, (_args, _okay, _) in enumerate(self.queue):
-                    if cellid == _args.cellid:
+            if cellid not in cellids:
+                for i, request in enumerate(self.queue):
+                    if cellid == request.args.get('cellid'):
                         del self.queue[i]
                         okay('interrupted')
 
-                        result = {
-                            'source': _args.source,
-                            'index': None,
-                            'time': 0,
-                            'out': u'',
-                            'err': u'',
-                            'plots': [],
-                            'traceback': False,
-                            'interrupted': True,
-                        }
-
-                        _okay(result)
+                        if request.args.get('stream') is not None:
+                            self._finish_stream(self.streams[request.args.stream])
+
+                        request.okay(request.interrupted())
                         return
+            elif len(self.evaluating) > 1:
+                # Only the engine knows which piece of a batch is running.
+                # Pieces that haven't started yet are skipped (and reported
+                # as interrupted), the running one is interrupted.
+                batch = self.evaluating
+
+                def _okay(status):
+                    if status == 'running' and self.evaluating is batch:
+                        self._interrupt()
+
+                    if status == 'done':
+                        okay('not-evaluating')
+                    else:
+                        okay('interrupted')
+
+                self.transport.call('skip', cellids.index(cellid), _okay, fail)
+                return
 
         # Now the most interesting part. To physically interrupt
         # the interpreter associated with this engine, we send
@@ -222,7 +430,7 @@ class EngineProcess(EngineBase):
         # this signal via KeyboardInterrupt exception and return
         # partial output and information that the computation was
         # interrupted. If there are any requests pending, then
-        # evaluation handler (_on_evaluate_handler) will schedule
+        # evaluation handler (_on_evaluate_finish) will schedule
         # next request for evaluation. This way we have only one
         # one path of data flow in all cases.
 
@@ -233,37 +441,94 @@ class EngineProcess(EngineBase):
         """Send interruption signal to an engine process. """
         self.process.send_signal(signal.SIGINT)
 
-    def _schedule(self, args, okay, fail):
-        """Push evaluation request at the end of the queue. """
-        self.queue.append((args, okay, fail))
+    def _schedule(self, request):
+        """Push a request at the end of the appropriate queue.
+
+        Inspection requests go to the priority queue, so that they
+        don't wait behind long running computations.
+        """
+        if request.is_inspect:
+            self.priority.append(request)
+        else:
+            self.queue.append(request)
+
+    def _next_batch(self):
+        """Take the next request (or a batch of requests) to evaluate. """
+        if self.priority:
+            return [self.priority.popleft()]
+
+        batch = [self.queue.popleft()]
+
+        if batch[0].is_batchable:
+            limit = self.settings.evaluate_batch_size
 
-    def _evaluate(self, method='evaluate'):
-        """Evaluate next pending request if engine not busy. """
-        if not self.evaluating and self.queue:
-            args, okay, fail = self.evaluating = self.queue.pop()
+            while self.queue and len(batch) < limit and self.queue[0].is_batchable:
+                batch.append(self.queue.popleft())
 
-            body = utilities.xml_encode(args.source, method)
-            headers = HTTPHeaders({'Content-Type': 'application/xml'})
+        return batch
 
-            request = HTTPRequest(self.url, method='POST',
-                body=body, headers=headers, request_timeout=0)
+    def _evaluate(self):
+        """Evaluate next pending request(s) if engine not busy. """
+        if not self.evaluating and (self.queue or self.priority):
+            batch = self.evaluating = self._next_batch()
 
-            client = AsyncHTTPClient()
-            client.fetch(request, self._on_evaluate_handler)
+            now = time.time()
+
+            for request in batch:
+                wait = now - request.queued
+
+                self.waits += 1
+                self.wait_time += wait
+                self.wait_max = max(self.wait_max, wait)
+
+            if len(batch) == 1:
+                request, = batch
+
+                if request.args.get('stream') is not None:
+                    self.current_stream = self.streams[request.args.stream]
+
+                self.transport.call(request.method, request.args.source,
+                    self._on_evaluate_okay, self._on_evaluate_fail)
+            else:
+                sources, outputs = [], []
+
+                for request in batch:
+                    request.output_id = self._new_output_id()
+
+                    sources.append(request.args.source)
+                    outputs.append([ self._output_path(request.output_id, type) for type in ['out', 'err'] ])
+
+                params = {
+                    'sources': sources,
+                    'outputs': outputs,
+                    'limit': self.settings.output_buffer_size,
+                }
+
+                self.transport.call('evaluate_batch', params,
+                    self._on_batch_okay, self._on_evaluate_fail)
 
             timeout = self.settings.evaluate_timeout
 
             if timeout > 0:
+                # The limit is per request, so a batch gets the sum of
+                # limits of its requests (the engine doesn't report when
+                # individual pieces finish, so the timer can't be re-armed).
                 self.evaluate_timeout = self.ioloop.add_timeout(
-                    time.time() + timeout, self._on_evaluate_timeout)
+                    time.time() + timeout*len(batch), self._on_evaluate_timeout)
 
     def _on_evaluate_timeout(self):
         """Gets executed when evaluation was taking too long. """
-        self._interrupt()
+        if len(self.evaluating) > 1:
+            # Skip the rest of the batch, then interrupt the running piece.
+            self.transport.call('skip', -1,
+                lambda status: self._interrupt(),
+                lambda error: self._interrupt())
+        else:
+            self._interrupt()
 
-    def _on_evaluate_handler(self, response):
-        """Handler that gets executed when evaluation finishes. """
-        _, okay, fail = self.evaluating
+    def _on_evaluate_finish(self):
+        """Cleanup after evaluation and schedule next request. """
+        batch = self.evaluating
         timeouted = False
 
         if self.evaluate_timeout is not None:
@@ -272,42 +537,123 @@ class EngineProcess(EngineBase):
             except ValueError:
                 timeouted = True
 
+        # Collect all remaining output before the next request
+        # is scheduled, because it may be streamed elsewhere.
+
+        self._read_stdout()
+        self._read_stderr()
+
+        stream, self.current_stream = self.current_stream, None
+
+        if stream is not None:
+            self._finish_stream(stream)
+
         self.evaluating = False
         self._evaluate()
 
-        if response.code == 200:
-            try:
-                result = utilities.xml_decode(response.body)
-            except xmlrpclib.Fault, exc:
-                fail('fault: %s' % exc)
-            else:
-                self._process_response(result, timeouted, okay)
+        return batch, timeouted, stream
+
+    def _on_evaluate_okay(self, result):
+        """Handler that gets executed when evaluation finishes. """
+        (request,), timeouted, stream = self._on_evaluate_finish()
+        self._process_response(result, timeouted, stream, request.okay)
+        self._reset_io()
+
+    def _on_batch_okay(self, results):
+        """Handler that gets executed when batch evaluation finishes. """
+        batch, timeouted, _ = self._on_evaluate_finish()
+
+        # Output of each request was captured by the engine. Anything
+        # that got to the pipes anyway (e.g. written by C extensions)
+        # is attributed to the last request in the batch.
+
+        result = results[-1]
+        result['out'] += self.out.getvalue()
+        result['err'] += self.err.getvalue()
+
+        for request, result in zip(batch, results):
+            spilled = result.pop('spilled', None)
+
+            if spilled is not None:
+                self._add_spilled(request.output_id)
+
+                result['output'] = dict(spilled, id=request.output_id)
+
+                for type in ['out', 'err']:
+                    if spilled[type] > self.settings.output_buffer_size:
+                        result[type] += OutputBuffer.marker % spilled[type]
+
+            # Only the piece that was running got interrupted by the timeout,
+            # the rest was either finished or skipped (reported with no index).
+            interrupted = result.get('interrupted') and result.get('index') is not None
+
+            self._process_response(result, timeouted and interrupted, None, request.okay)
+
+        self._reset_io()
+
+    def _on_evaluate_fail(self, error):
+        """Handler that gets executed when evaluation fails. """
+        batch, _, _ = self._on_evaluate_finish()
+
+        if error == 'connection-closed' and not self.is_dead:
+            # The engine most likely died (e.g. exceeded a limit), so
+            # wait a while for its exit status to tell clients why.
+            self.lost.extend(batch)
+
+            if self.lost_timeout is None:
+                self.lost_timeout = self.ioloop.add_timeout(
+                    time.time() + self.LOST_TIMEOUT, self._fail_lost)
         else:
-            import pdb
-            pdb.set_trace()
-            fail('response-code: %s' % response.code)
+            for request in batch:
+                request.fail(error)
 
         self._reset_io()
 
-    def _process_response(self, result, timeouted, okay):
+    def _fail_lost(self, error='connection-closed'):
+        """Fail requests that lost connection to the engine. """
+        if self.lost_timeout is not None:
+            try:
+                self.ioloop.remove_timeout(self.lost_timeout)
+            except ValueError:
+                pass
+
+            self.lost_timeout = None
+
+        lost, self.lost = self.lost, []
+
+        for request in lost:
+            request.fail(error)
+
+    def _process_response(self, result, timeouted, stream, okay):
         """Perform final processing of evaluation results. """
         result['memory'] = self.get_stat()['memory']['rss']
 
         if timeouted:
             result['timeout'] = True
 
-        self._read_stdout()
-        self._read_stderr()
+        if stream is not None:
+            result['out'] = u''
+            result['err'] = u''
+            result['stream'] = {'id': stream.id, 'seq': stream.seq}
+        elif 'out' in result:
+            pass # captured by the engine (batch evaluation)
+        else:
+            result['out'] = self.out.getvalue()
+            result['err'] = self.err.getvalue()
 
-        result['out'] = self.out.getvalue()
-        result['err'] = self.err.getvalue()
+            if self.out.spilled or self.err.spilled:
+                result['output'] = {
+                    'id': self.output_id,
+                    'out': self.out.size,
+                    'err': self.err.size,
+                }
 
-        hl = highlight.Highlight()
+        jobs = {}
 
         traceback = result.get('traceback')
 
         if traceback:
-            result['traceback_html'] = hl.traceback(traceback)
+            jobs['traceback_html'] = ('traceback', traceback)
 
         info = result.get('info')
 
@@ -315,17 +661,28 @@ class EngineProcess(EngineBase):
             docstring = info.get('docstring')
 
             if docstring is not None:
-                info['docstring_html'] = hl.docstring(docstring)
+                jobs['docstring_html'] = ('docstring', docstring)
 
             source = info.get('source')
 
             if source is not None:
-                info['source_html'] = hl.python(source)
+                jobs['source_html'] = ('python', source)
 
             args = info.get('args')
 
             if args is not None:
-                info['args_html'] = hl.python(args)
+                jobs['args_html'] = ('python', args)
+
+        def _okay(rendered):
+            traceback_html = rendered.pop('traceback_html', None)
+
+            if traceback_html is not None:
+                result['traceback_html'] = traceback_html
+
+            if info is not None:
+                info.update(rendered)
+
+            okay(result)
 
-        okay(result)
+        RenderPool.instance().render(jobs, _okay)
 
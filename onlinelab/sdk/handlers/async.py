@@ -2,6 +2,8 @@
 
 from .base import WebHandler
 from ..processes import ProcessManager
+from ..metrics import StartupStats
+from ..workers import RenderPool
 
 from ...utils import jsonrpc
 from ...utils import Args
@@ -23,7 +25,11 @@ class AsyncHandler(WebHandler):
     def call(self, method, uuid, args):
         """Call ``method`` with ``args`` on a process manager. """
         manager = ProcessManager.instance()
-        getattr(manager, method)(uuid, args, self.on_okay, self.on_fail)
+
+        if manager.worker is not None:
+            manager.worker.call(method, uuid, args, self.on_okay, self.on_fail)
+        else:
+            getattr(manager, method)(uuid, args, self.on_okay, self.on_fail)
 
     @jsonrpc.method
     def RPC__Engine__init(self, uuid=None, engine=None):
@@ -40,15 +46,33 @@ class AsyncHandler(WebHandler):
         """Process 'stat' method call from a client. """
         self.call('stat', uuid, Args())
 
+    @jsonrpc.method
+    def RPC__Engine__stats(self):
+        """Process 'stats' method call from a client. """
+        self.on_okay({
+            'startup': StartupStats.instance().get_stat(),
+            'render': RenderPool.instance().get_stat(),
+        })
+
     @jsonrpc.method
     def RPC__Engine__complete(self, uuid, source):
         """Process 'complete' method call from a client. """
         self.call('complete', uuid, Args(source=source))
 
     @jsonrpc.method
-    def RPC__Engine__evaluate(self, uuid, source, cellid=None):
+    def RPC__Engine__evaluate(self, uuid, source, cellid=None, stream=None):
         """Process 'evaluate' method call from a client. """
-        self.call('evaluate', uuid, Args(source=source, cellid=cellid))
+        self.call('evaluate', uuid, Args(source=source, cellid=cellid, stream=stream))
+
+    @jsonrpc.method
+    def RPC__Engine__stream(self, uuid, stream, seq=0):
+        """Process 'stream' method call from a client. """
+        self.call('stream', uuid, Args(stream=stream, seq=seq))
+
+    @jsonrpc.method
+    def RPC__Engine__output(self, uuid, output, type='out', offset=0, size=None):
+        """Process 'output' method call from a client. """
+        self.call('output', uuid, Args(output=output, type=type, offset=offset, size=size))
 
     @jsonrpc.method
     def RPC__Engine__interrupt(self, uuid, cellid=None):
@@ -4,12 +4,18 @@ import smtplib
 
 from datetime import datetime
 
+from django.db.models import Count, Max
+
 from base import WebHandler
 
 from ..auth import authenticate
-from ..models import User, Engine, Folder, Worksheet, Cell
+from ..models import User, Engine, Folder, Worksheet, Cell, POSITION_GAP, get_position
+from ..workers import RenderPool
+from ..published import PublishedCache
+from ..database import atomic, batches, bulk_create, bulk_delete
 
 from ...utils import jsonrpc
+from ...utils.api import APIError
 
 class TemplateAPIMixin(object):
     """Client APIs related to template rendering. """
@@ -166,14 +172,54 @@ class CoreAPIMixin(object):
         self.return_api_result({'users': users})
 
     @jsonrpc.method
-    def RPC__Core__getPublishedWorksheets(self):
-        """Return a list of all published worksheets by users. """
-        users = []
+    def RPC__Core__getPublishedWorksheets(self, offset=0, limit=None):
+        """Return a list of all published worksheets by users.
 
-        for user in User.objects.all():
-            user_worksheets = []
+        Users are sorted according to the number of their published
+        worksheets and can be fetched in pages with ``offset`` and
+        ``limit`` (``total`` is the number of all users).
+        """
+        try:
+            offset = int(offset)
+
+            if limit is not None:
+                limit = int(limit)
+        except (TypeError, ValueError):
+            self.return_api_error('bad-range')
+            return
+
+        if offset < 0 or (limit is not None and limit < 0):
+            self.return_api_error('bad-range')
+            return
+
+        published = Worksheet.objects.filter(published__isnull=False)
+
+        # Any change to published worksheets changes the version, so that
+        # also lists cached by other SDK workers can't get stale.
+        version = published.aggregate(count=Count('id'), modified=Max('modified'))
+        version = (version['count'], version['modified'])
+
+        cache = PublishedCache.instance()
+        users = cache.get_index(version)
+
+        if users is None:
+            users, index, size = [], {}, 0
+
+            for worksheet in published.select_related('user', 'engine').order_by('user', 'id'):
+                user = worksheet.user
+
+                try:
+                    user_worksheets = index[user.id]
+                except KeyError:
+                    user_worksheets = index[user.id] = []
+
+                    users.append({
+                        'username': user.username,
+                        'first_name': user.first_name,
+                        'last_name': user.last_name,
+                        'worksheets': user_worksheets,
+                    })
 
-            for worksheet in Worksheet.objects.filter(user=user, published__isnull=False):
                 user_worksheets.append({
                     'uuid': worksheet.uuid,
                     'name': worksheet.name,
@@ -187,20 +233,20 @@ class CoreAPIMixin(object):
                     },
                 })
 
-            if len(user_worksheets) > 0:
-                data = {
-                    'username': user.username,
-                    'first_name': user.first_name,
-                    'last_name': user.last_name,
-                    'worksheets': user_worksheets,
-                }
-                users.append(data)
+                size += len(worksheet.name) + len(worksheet.description) + 300
+
+            # Sort users according to the number of published worksheets
+            users.sort(key=lambda user: len(user["worksheets"]), reverse=True)
+
+            cache.put_index(version, users, size)
 
-        # Sort users according to the number of published worksheets
-        users.sort(key=lambda user: len(user["worksheets"]), reverse=True)
+        if limit is not None:
+            page = users[offset:offset+limit]
+        else:
+            page = users[offset:]
 
         # XXX: this API doesn't make sense: published worksheets -> users
-        self.return_api_result({'users': users})
+        self.return_api_result({'users': page, 'total': len(users)})
 
 class FolderAPIMixin(object):
     """Client APIs related to folders management. """
@@ -281,20 +327,35 @@ class FolderAPIMixin(object):
         except Folder.DoesNotExist:
             self.return_api_error('does-not-exist')
         else:
-            def _get_worksheets(folder):
-                """Collect all worksheets in ``folder``. """
-                worksheets = []
+            # Fetch all folders (and worksheets) at once and assemble the
+            # tree in memory, instead of querying children of each folder.
+
+            if recursive:
+                folders = Folder.objects.filter(user=self.user)
+            else:
+                folders = Folder.objects.filter(user=self.user, parent=parent)
+
+            children = {}
+
+            for folder in folders:
+                children.setdefault(folder.parent_id, []).append(folder)
 
-                for worksheet in Worksheet.objects.filter(user=self.user, folder=folder):
-                    worksheets.append({'uuid': worksheet.uuid, 'name': worksheet.name})
+            contents = {}
 
-                return worksheets
+            if worksheets:
+                query = Worksheet.objects.filter(user=self.user, folder__isnull=False)
 
-            def _get_folders(parent):
-                """Collect all sub-folders of ``parent``. """
+                if not recursive:
+                    query = query.filter(folder__parent=parent)
+
+                for data in query.values('uuid', 'name', 'folder'):
+                    contents.setdefault(data['folder'], []).append({'uuid': data['uuid'], 'name': data['name']})
+
+            def _get_folders(parent_id):
+                """Collect all sub-folders of a folder with ``parent_id``. """
                 folders = []
 
-                for folder in Folder.objects.filter(user=self.user, parent=parent):
+                for folder in children.get(parent_id, []):
                     data = {
                         'uuid': folder.uuid,
                         'name': folder.name,
@@ -304,16 +365,21 @@ class FolderAPIMixin(object):
                     }
 
                     if recursive:
-                        data['folders'] = _get_folders(folder)
+                        data['folders'] = _get_folders(folder.id)
 
                     if worksheets:
-                        data['worksheets'] = _get_worksheets(folder)
+                        data['worksheets'] = contents.get(folder.id, [])
 
                     folders.append(data)
 
                 return folders
 
-            self.return_api_result({'folders': _get_folders(parent)})
+            if parent is not None:
+                parent_id = parent.id
+            else:
+                parent_id = None
+
+            self.return_api_result({'folders': _get_folders(parent_id)})
 
     @jsonrpc.authenticated
     def RPC__Folder__getWorksheets(self, uuid):
@@ -385,6 +451,8 @@ class WorksheetAPIMixin(object):
         except Worksheet.DoesNotExist:
             self.return_api_error('does-not-exist')
         else:
+            PublishedCache.instance().invalidate(worksheet.uuid)
+
             worksheet.delete()
             self.return_api_result()
 
@@ -396,8 +464,7 @@ class WorksheetAPIMixin(object):
         except Worksheet.DoesNotExist:
             self.return_api_error('does-not-exist')
         else:
-            worksheet.name = name
-            worksheet.save()
+            worksheet.update_fields(name=name)
 
             self.return_api_result()
 
@@ -409,8 +476,7 @@ class WorksheetAPIMixin(object):
         except Worksheet.DoesNotExist:
             self.return_api_error('does-not-exist')
         else:
-            worksheet.description = description
-            worksheet.save()
+            worksheet.update_fields(description=description)
 
             self.return_api_result()
 
@@ -433,8 +499,7 @@ class WorksheetAPIMixin(object):
                 except Worksheet.DoesNotExist:
                     self.return_api_error('does-not-exist')
                 else:
-                    worksheet.folder = target
-                    worksheet.save()
+                    worksheet.update_fields(folder=target)
 
             self.return_api_result()
 
@@ -451,8 +516,9 @@ class WorksheetAPIMixin(object):
             elif worksheet.name == 'untitled':
                 self.return_api_error('choose-better-name')
             else:
-                worksheet.published = datetime.now()
-                worksheet.save()
+                worksheet.update_fields(published=datetime.now())
+
+                PublishedCache.instance().invalidate_index()
 
                 self.return_api_result()
 
@@ -482,26 +548,13 @@ class WorksheetAPIMixin(object):
             engine=origin.engine,
             origin=origin,
             folder=folder)
-        worksheet.save()
 
-        order = []
-
-        for uuid in origin.get_order():
-            try:
-                base = Cell.objects.get(uuid=uuid)
-            except Cell.DoesNotExist:
-                pass
-            else:
-                cell = Cell(user=self.user,
-                            type=base.type,
-                            parent=base.parent,
-                            content=base.content,
-                            worksheet=worksheet)
-                order.append(cell.uuid)
-                cell.save()
+        @atomic
+        def _fork():
+            worksheet.save()
+            self._copy_cells(origin, worksheet)
 
-        worksheet.set_order(order)
-        worksheet.save()
+        _fork()
 
         self.return_api_result({
             'uuid': worksheet.uuid,
@@ -525,29 +578,31 @@ class WorksheetAPIMixin(object):
             self.return_api_error('worksheet-was-modified')
             return
 
-        Cell.objects.filter(worksheet=worksheet).delete()
+        @atomic
+        def _sync():
+            Cell.objects.filter(worksheet=worksheet).delete()
+            self._copy_cells(worksheet.origin, worksheet)
 
-        order = []
+            worksheet.bump_revision()
 
-        for uuid in worksheet.origin.get_order():
-            try:
-                base = Cell.objects.get(uuid=uuid)
-            except Cell.DoesNotExist:
-                pass
-            else:
-                cell = Cell(user=self.user,
-                            type=base.type,
-                            parent=base.parent,
-                            content=base.content,
-                            worksheet=worksheet)
-                order.append(cell.uuid)
-                cell.save()
+        _sync()
 
-        worksheet.set_order(order)
-        worksheet.save()
+        PublishedCache.instance().invalidate(worksheet.uuid)
 
         self.return_api_result()
 
+    def _copy_cells(self, origin, worksheet):
+        """Copy all cells of ``origin`` to ``worksheet`` in bulk. """
+        fields = ('type', 'parent', 'content', 'position')
+
+        bulk_create(Cell, [ Cell(user=self.user,
+                                 worksheet=worksheet,
+                                 type=type,
+                                 parent_id=parent_id,
+                                 content=content,
+                                 position=position)
+            for type, parent_id, content, position in origin.get_cells().values_list(*fields) ])
+
     def allowWorksheetAccess(self, worksheet):
         """Returns ``True`` if current user is allowed to load this worksheet. """
         if worksheet.published is not None:
@@ -567,22 +622,34 @@ class WorksheetAPIMixin(object):
                 self.return_api_error('permission-denied')
                 return
 
-            data, cells = {}, []
+            # Published worksheets can be loaded by many users at once.
+            if worksheet.published is not None:
+                cache = PublishedCache.instance()
+                cells = cache.get(worksheet.uuid, worksheet.modified, ('cells', type))
+            else:
+                cache, cells = None, None
+
+            if cells is None:
+                cells, size = [], 0
+                query = worksheet.get_cells()
+
+                if type is not None:
+                    query = query.filter(type=type)
 
-            for cell in Cell.objects.filter(worksheet=worksheet):
-                if type is None or cell.type == type:
-                    data[cell.uuid] = {
+                for cell in query:
+                    cells.append({
                         'uuid': cell.uuid,
                         'type': cell.type,
                         'content': cell.content,
                         'collapsed': cell.collapsed,
-                    }
+                    })
+
+                    size += len(cell.content) + 100
 
-            for uuid in worksheet.get_order():
-                if uuid in data:
-                    cells.append(data[uuid])
+                if cache is not None:
+                    cache.put(worksheet.uuid, worksheet.modified, ('cells', type), cells, size)
 
-            self.return_api_result({'cells': cells})
+            self.return_api_result({'cells': cells, 'revision': worksheet.revision})
 
     @jsonrpc.authenticated
     def RPC__Worksheet__save(self, uuid, cells):
@@ -592,41 +659,219 @@ class WorksheetAPIMixin(object):
         except Worksheet.DoesNotExist:
             self.return_api_error('does-not-exist')
         else:
-            order = []
+            # Load all cells at once, insert new ones in bulk and touch
+            # only those existing cells that actually changed, all in a
+            # single transaction (this is called on each autosave).
 
-            for data in cells:
-                uuid = data['uuid']
-                type = data['type']
-                content = data['content']
-                collapsed = data['collapsed']
+            @atomic
+            def _save():
+                existing = {}
 
-                try:
-                    cell = Cell.objects.get(user=self.user, uuid=uuid)
-                except Cell.DoesNotExist:
-                    cell = Cell(uuid=uuid,
-                                user=self.user,
-                                worksheet=worksheet,
-                                type=type,
-                                content=content,
-                                collapsed=collapsed)
-                else:
-                    cell.type = type
-                    cell.content = content
-                    cell.collapsed = collapsed
+                for cell in Cell.objects.filter(user=self.user, worksheet=worksheet):
+                    existing[cell.uuid] = cell
+
+                missing = [ data['uuid'] for data in cells if data['uuid'] not in existing ]
+
+                for batch in batches(missing):
+                    for cell in Cell.objects.filter(user=self.user, uuid__in=batch):
+                        existing[cell.uuid] = cell
+
+                uuids, created = set(), []
+                now = datetime.now()
+
+                for i, data in enumerate(cells):
+                    uuid = data['uuid']
+                    type = data['type']
+                    content = data['content']
+                    collapsed = data['collapsed']
+                    position = (i+1)*POSITION_GAP
+
+                    try:
+                        cell = existing[uuid]
+                    except KeyError:
+                        created.append(Cell(uuid=uuid,
+                                            user=self.user,
+                                            worksheet=worksheet,
+                                            type=type,
+                                            content=content,
+                                            collapsed=collapsed,
+                                            position=position))
+                    else:
+                        if (cell.type, cell.content, cell.collapsed) != (type, content, collapsed):
+                            Cell.objects.filter(pk=cell.pk).update(type=type,
+                                content=content, collapsed=collapsed, position=position, modified=now)
+                        elif cell.position != position:
+                            Cell.objects.filter(pk=cell.pk).update(position=position)
+
+                    uuids.add(uuid)
+
+                bulk_create(Cell, created)
+
+                bulk_delete(Cell, [ cell.pk for cell in existing.itervalues()
+                    if cell.worksheet_id == worksheet.id and cell.uuid not in uuids ])
+
+                worksheet.bump_revision()
+
+            _save()
+
+            PublishedCache.instance().invalidate(worksheet.uuid)
 
+            self.return_api_result({'revision': worksheet.revision})
+
+    @jsonrpc.authenticated
+    def RPC__Worksheet__patch(self, uuid, revision, ops):
+        """Apply cell operations to a worksheet at the given ``revision``.
+
+        Each operation is a dict with ``op`` and cell's ``uuid``:
+
+        * ``insert`` --- new cell with ``type``, ``content``, ``collapsed``
+        * ``update`` --- change any of ``type``, ``content``, ``collapsed``
+        * ``delete`` --- remove a cell
+        * ``move``   --- move a cell
+
+        ``insert`` and ``move`` put a cell right after a cell with uuid
+        ``after`` (or at the beginning if ``after`` is ``None``). All
+        operations are applied or none is, and only if the worksheet
+        wasn't changed since ``revision``.
+        """
+        try:
+            worksheet = Worksheet.objects.get(user=self.user, uuid=uuid)
+        except Worksheet.DoesNotExist:
+            self.return_api_error('does-not-exist')
+            return
+
+        if worksheet.revision != revision:
+            self.return_api_error('stale-revision')
+            return
+
+        @atomic
+        def _patch():
+            order, positions = [], {}
+
+            for uuid, position in worksheet.get_cells().values_list('uuid', 'position'):
                 order.append(uuid)
-                cell.save()
+                positions[uuid] = position
+
+            # Cell UUIDs are unique across worksheets, so look for inserted
+            # ones everywhere, else bulk_create() would hit the constraint.
+            targets = [ op['uuid'] for op in ops if op['op'] in ['insert', 'update', 'delete'] ]
+            existing, taken = {}, set()
+
+            for batch in batches(targets):
+                for cell in Cell.objects.filter(uuid__in=batch):
+                    if cell.worksheet_id == worksheet.pk and cell.user_id == self.user.pk:
+                        existing[cell.uuid] = cell
+                    else:
+                        taken.add(cell.uuid)
+
+            moved = set()
+
+            def _place(uuid, after):
+                if after is None:
+                    index = 0
+                elif after != uuid and after in positions:
+                    index = order.index(after) + 1
+                else:
+                    raise PatchError('cell-does-not-exist')
 
-            worksheet.set_order(order)
-            worksheet.save()
+                lower = positions[order[index-1]] if index > 0 else None
+                upper = positions[order[index]] if index < len(order) else None
+
+                position = get_position(lower, upper)
+                order.insert(index, uuid)
+
+                if position is not None:
+                    positions[uuid] = position
+                    moved.add(uuid)
+                else:
+                    # No room left, so renumber (rarely happens).
+                    for i, _uuid in enumerate(order):
+                        positions[_uuid] = (i+1)*POSITION_GAP
+
+                    moved.update(order)
+
+            fields = ['type', 'content', 'collapsed']
+
+            created, changed, deleted = {}, {}, []
+
+            for op in ops:
+                uuid = op['uuid']
+
+                if op['op'] == 'insert':
+                    if uuid in positions or uuid in taken:
+                        raise PatchError('cell-exists')
+
+                    created[uuid] = Cell(uuid=uuid,
+                                         user=self.user,
+                                         worksheet=worksheet,
+                                         type=op['type'],
+                                         content=op['content'],
+                                         collapsed=op.get('collapsed', False))
+                    _place(uuid, op.get('after'))
+                elif uuid not in positions:
+                    raise PatchError('cell-does-not-exist')
+                elif op['op'] == 'update':
+                    values = dict([ (field, op[field]) for field in fields if field in op ])
+
+                    if uuid in created:
+                        for field, value in values.iteritems():
+                            setattr(created[uuid], field, value)
+                    elif uuid in existing:
+                        changed.setdefault(uuid, {}).update(values)
+                    else:
+                        raise PatchError('cell-does-not-exist')
+                elif op['op'] == 'delete':
+                    order.remove(uuid)
+                    del positions[uuid]
+
+                    if uuid in created:
+                        del created[uuid]
+                    else:
+                        changed.pop(uuid, None)
+
+                        if uuid in existing:
+                            deleted.append(existing[uuid].pk)
+                elif op['op'] == 'move':
+                    order.remove(uuid)
+                    _place(uuid, op.get('after'))
+                else:
+                    raise PatchError('bad-operation')
 
-            uuids = set(order)
+            now = datetime.now()
 
-            for cell in Cell.objects.filter(user=self.user, worksheet=worksheet):
-                if cell.uuid not in uuids:
-                    cell.delete()
+            for uuid, values in changed.iteritems():
+                Cell.objects.filter(pk=existing[uuid].pk).update(modified=now, **values)
 
-            self.return_api_result()
+            for uuid in moved:
+                if uuid in created:
+                    created[uuid].position = positions[uuid]
+                elif uuid in positions:
+                    Cell.objects.filter(worksheet=worksheet, uuid=uuid).update(position=positions[uuid])
+
+            # Delete first, a deleted cell may be inserted again.
+            bulk_delete(Cell, deleted)
+            bulk_create(Cell, created.values())
+
+            # Conditional update, so that concurrent patches can't both win.
+            updated = Worksheet.objects.filter(pk=worksheet.pk, revision=revision).update(
+                revision=revision + 1, modified=now)
+
+            if not updated:
+                raise PatchError('stale-revision')
+
+        try:
+            _patch()
+        except (KeyError, TypeError):
+            raise PatchError('bad-operation')
+
+        PublishedCache.instance().invalidate(worksheet.uuid)
+        self.return_api_result({'revision': revision + 1})
+
+class PatchError(APIError):
+    """Raised when a worksheet patch can't be applied. """
+
+    def __init__(self, error):
+        self.error = error
 
 class ParseError(Exception):
     """Raised when '{{{' or '}}}' is misplaced. """
@@ -725,15 +970,9 @@ class DocutilsAPIMixin(object):
                     worksheet = Worksheet.objects.create(user=self.user,
                         name=name, engine=engine, folder=folder)
 
-                    order = []
-
-                    for type, content in cells:
-                        cell = Cell.objects.create(user=self.user,
-                            worksheet=worksheet, content=content, type=type)
-                        order.append(cell.uuid)
-
-                    worksheet.order = ','.join(order)
-                    worksheet.save()
+                    for i, (type, content) in enumerate(cells):
+                        Cell.objects.create(user=self.user, worksheet=worksheet,
+                            content=content, type=type, position=(i+1)*POSITION_GAP)
 
                     self.return_api_result({'uuid': worksheet.uuid, 'count': len(cells)})
 
@@ -747,13 +986,7 @@ class DocutilsAPIMixin(object):
         else:
             rst = []
 
-            for uuid in worksheet.get_order():
-                try:
-                    cell = Cell.objects.get(user=self.user, uuid=uuid)
-                except Cell.DoesNotExist:
-                    self.return_api_error('cell-does-not-exist')
-                    return
-
+            for cell in worksheet.get_cells():
                 if cell.type == 'rst':
                     rst.append(cell.content)
                     continue
@@ -769,8 +1002,13 @@ class DocutilsAPIMixin(object):
     @jsonrpc.authenticated
     def RPC__Docutils__render(self, rst):
         """Transform RST source code to HTML with Online Lab CSS. """
-        parts = docutils.core.publish_parts(rst, writer_name='html')
-        self.return_api_result({'html': parts['fragment']})
+        def _okay(rendered):
+            if rendered['html'] is not None:
+                self.return_api_result(rendered)
+            else:
+                self.return_api_error('render-error')
+
+        RenderPool.instance().render({'html': ('rst', rst)}, _okay)
 
 class ClientHandler(TemplateAPIMixin, UserAPIMixin, CoreAPIMixin,
         FolderAPIMixin, WorksheetAPIMixin, DocutilsAPIMixin, WebHandler):
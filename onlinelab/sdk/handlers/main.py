@@ -4,7 +4,6 @@ import logging
 import traceback
 
 import docutils.core
-import pygments.formatters
 
 import tornado.web
 
@@ -19,11 +18,8 @@ class MainHandler(ErrorMixin, tornado.web.RequestHandler):
         self.debug = debug or self._settings.debug
 
     def get(self):
-        html = pygments.formatters.HtmlFormatter(nobackground=True)
-        css = html.get_style_defs(arg='.highlight')
-
         try:
-            self.render('femhub/desktop.html', debug=self.debug, extra_css=css,
+            self.render('femhub/desktop.html', debug=self.debug,
                 settings=self._settings, modules=self.settings['modules'])
         except:
             logging.error("error rendering 'femhub/desktop.html'")
@@ -1,14 +1,16 @@
 """Implementation of RESTful handlers. """
 
 import logging
+import calendar
+import email.utils
 
 import tornado.web
 
 import docutils.core
-import pygments.formatters
 
 from ..errors import ErrorMixin
 from ..models import User, Engine, Folder, Worksheet, Cell
+from ..published import PublishedCache
 
 from ...utils.settings import Settings
 
@@ -18,25 +20,66 @@ class RESTfulRequestHandler(ErrorMixin, tornado.web.RequestHandler):
 class PublishedWorksheetHandler(RESTfulRequestHandler):
     """Render a public worksheet identified by an UUID. """
 
+    def is_not_modified(self, etag, timestamp):
+        """Check if client's copy of a page is up to date. """
+        if_none_match = self.request.headers.get('If-None-Match')
+
+        if if_none_match is not None:
+            tags = [ tag.strip() for tag in if_none_match.split(',') ]
+            return etag in tags or '*' in tags
+
+        if_modified_since = self.request.headers.get('If-Modified-Since')
+
+        if if_modified_since is not None:
+            date = email.utils.parsedate_tz(if_modified_since)
+
+            if date is not None:
+                return email.utils.mktime_tz(date) >= timestamp
+
+        return False
+
     def get(self, uuid):
         settings = Settings.instance()
 
-        html = pygments.formatters.HtmlFormatter(nobackground=True)
-        css = html.get_style_defs(arg='.highlight')
+        # Only version of a worksheet is needed to answer conditional
+        # requests and to look up the cache, so don't load everything.
 
         try:
-            worksheet = Worksheet.objects.get(uuid=uuid)
+            modified, published = Worksheet.objects.filter(uuid=uuid).values_list('modified', 'published').get()
         except Worksheet.DoesNotExist:
             raise tornado.web.HTTPError(404)
         except Worksheet.MultipleObjectsReturned:
             raise tornado.web.HTTPError(500)
 
-        if worksheet.published is None:
+        if published is None:
             raise tornado.web.HTTPError(401)
 
-        try:
-            self.render('femhub/worksheet.html', debug=settings.debug, extra_css=css,
-                uuid=uuid, name=worksheet.name, user=worksheet.user.username)
-        except:
-            raise tornado.web.HTTPError(500)
+        timestamp = calendar.timegm(modified.utctimetuple())
+        etag = '"%s-%d.%06d"' % (uuid, timestamp, modified.microsecond)
+
+        self.set_header('Etag', etag)
+        self.set_header('Last-Modified', modified)
+        self.set_header('Cache-Control', 'public, no-cache')
+
+        if self.is_not_modified(etag, timestamp):
+            self.set_status(304)
+            return
+
+        cache = PublishedCache.instance()
+        page = cache.get(uuid, modified, 'page')
+
+        if page is None:
+            try:
+                worksheet = Worksheet.objects.select_related('user').get(uuid=uuid)
+            except Worksheet.DoesNotExist:
+                raise tornado.web.HTTPError(404)
+
+            try:
+                page = self.render_string('femhub/worksheet.html', debug=settings.debug,
+                    uuid=uuid, name=worksheet.name, user=worksheet.user.username)
+            except:
+                raise tornado.web.HTTPError(500)
+
+            cache.put(uuid, modified, 'page', page, len(page))
 
+        self.write(page)
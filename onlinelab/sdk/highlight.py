@@ -1,5 +1,7 @@
 """Source code highlighting and text rendering based on Pygments and Docutils. """
 
+import os
+
 import pygments
 
 from pygments.lexers import PythonLexer, PythonTracebackLexer
@@ -22,11 +24,34 @@ def class_role(role, rawtext, text, lineno, inliner, options={}, content=[]):
 
 roles.register_canonical_role('class', class_role)
 
+def get_css():
+    """Return style definitions for highlighted code. """
+    return HtmlFormatter(nobackground=True).get_style_defs(arg='.highlight')
+
+def write_css(path):
+    """Store style definitions in a (static) file, unless it is up to date. """
+    css = get_css()
+    directory = os.path.dirname(path)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    elif os.path.exists(path):
+        with open(path) as file:
+            if file.read() == css:
+                return
+
+    with open(path, 'w') as file:
+        file.write(css)
+
 class Highlight(object):
     """Simple class for highlighting Python. """
 
     _settings = {'halt_level': utils.Reporter.ERROR_LEVEL}
 
+    _python = PythonLexer()
+    _traceback = PythonTracebackLexer()
+    _formatter = HtmlFormatter()
+
     def docstring(self, text):
         """Render a Python docstring. """
         try:
@@ -38,9 +63,12 @@ class Highlight(object):
 
     def python(self, code):
         """Highlight a piece of Python source code. """
-        return pygments.highlight(code, PythonLexer(), HtmlFormatter())
+        return pygments.highlight(code, self._python, self._formatter)
 
     def traceback(self, tb):
         """Highlight text of a Python traceback. """
-        return pygments.highlight(tb, PythonTracebackLexer(), HtmlFormatter())
+        return pygments.highlight(tb, self._traceback, self._formatter)
 
+    def rst(self, text):
+        """Render a reStructuredText document. """
+        return core.publish_parts(text, writer_name='html')['fragment']
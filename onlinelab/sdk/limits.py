@@ -0,0 +1,119 @@
+"""Per-engine resource limits (rlimits and cgroup v2 quotas). """
+
+import os
+import signal
+import logging
+
+from ..engines.utils.limits import rlimits, apply_limits
+from ..utils.settings import Settings
+
+class LimitsError(Exception):
+    """Represents a failure to set up limits of an engine. """
+
+class EngineLimits(object):
+    """Resource limits of a single engine process.
+
+    Limits are configured per engine type in ``engine_limits`` setting
+    (the ``'*'`` entry applies to all engine types). Names listed in
+    :data:`rlimits` are applied with ``setrlimit()`` in the child. The
+    rest (``memory``, ``cpu`` and ``pids``) are cgroup v2 quotas, which
+    require ``cgroup_path`` to point to a writable cgroup with memory,
+    cpu and pids controllers enabled in its ``cgroup.subtree_control``.
+    """
+
+    quotas = ['memory', 'cpu', 'pids']
+
+    cpu_period = 100000
+
+    def __init__(self, name, uuid):
+        self.settings = Settings.instance()
+
+        self.limits = {}
+        self.limits.update(self.settings.engine_limits.get('*', {}))
+        self.limits.update(self.settings.engine_limits.get(name, {}))
+
+        self.uuid = uuid
+        self.cgroup = None
+
+    @property
+    def spec(self):
+        """Description of limits to apply in a child process. """
+        return {
+            'rlimits': dict([ (name, value) for name, value in self.limits.iteritems() if name in rlimits ]),
+            'cgroup': self.cgroup,
+        }
+
+    def setup(self):
+        """Validate limits and create a cgroup if any quota was requested. """
+        for name in self.limits:
+            if name not in rlimits and name not in self.quotas:
+                raise LimitsError("unknown limit '%s'" % name)
+
+        quotas = [ name for name in self.quotas if name in self.limits ]
+
+        if not quotas:
+            return
+
+        if not self.settings.cgroup_path:
+            raise LimitsError("'cgroup_path' is required for %s quotas" % ', '.join(quotas))
+
+        self.cgroup = os.path.join(self.settings.cgroup_path, 'engine-%s' % self.uuid)
+
+        try:
+            os.mkdir(self.cgroup)
+
+            if 'memory' in self.limits:
+                self._write('memory.max', self.limits['memory'])
+
+                if os.path.exists(os.path.join(self.cgroup, 'memory.swap.max')):
+                    self._write('memory.swap.max', 0)
+            if 'cpu' in self.limits:
+                self._write('cpu.max', '%d %d' % (self.limits['cpu']*self.cpu_period, self.cpu_period))
+            if 'pids' in self.limits:
+                self._write('pids.max', self.limits['pids'])
+        except (IOError, OSError) as exc:
+            self.cleanup()
+            raise LimitsError("can't set up cgroup: %s" % exc)
+
+    def _write(self, name, value):
+        with open(os.path.join(self.cgroup, name), 'w') as file:
+            file.write('%s\n' % value)
+
+    def preexec_fn(self):
+        """Apply limits in a child process (before ``exec()``). """
+        apply_limits(self.spec)
+
+    def _get_events(self, name):
+        """Read counters from an events file of the cgroup. """
+        events = {}
+
+        try:
+            with open(os.path.join(self.cgroup, name)) as file:
+                for line in file:
+                    key, value = line.split()
+                    events[key] = int(value)
+        except (IOError, OSError, ValueError):
+            pass
+
+        return events
+
+    def get_reason(self, returncode):
+        """Return which limit killed a process or ``None``. """
+        if self.cgroup is not None:
+            if self._get_events('memory.events').get('oom_kill'):
+                return 'memory-limit'
+
+        if 'cpu_time' in self.limits and returncode == -signal.SIGXCPU:
+            return 'cpu-limit'
+
+        return None
+
+    def cleanup(self):
+        """Remove the cgroup (must be called after the process exited). """
+        if self.cgroup is not None:
+            try:
+                os.rmdir(self.cgroup)
+            except OSError as exc:
+                logging.warning("Can't remove cgroup %s (%s)" % (self.cgroup, exc))
+
+            self.cgroup = None
@@ -0,0 +1,107 @@
+"""Aggregation of timings reported by engines. """
+
+import bisect
+
+class Histogram(object):
+    """Distribution of values in exponentially growing buckets. """
+
+    def __init__(self, base=0.001, factor=2.0, buckets=16):
+        self.bounds = [ base*factor**i for i in xrange(buckets) ]
+        self.counts = [0]*(buckets + 1)
+
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Record a single value. """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+        self.count += 1
+        self.sum += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Return upper bound of the bucket containing a percentile. """
+        if not self.count:
+            return None
+
+        rank = self.count*percent/100.0
+        total = 0
+
+        for bound, count in zip(self.bounds + [self.max], self.counts):
+            total += count
+
+            if total >= rank:
+                return min(bound, self.max)
+
+    def get_stat(self):
+        """Get summary and non-empty buckets of this histogram. """
+        if self.count:
+            mean = self.sum/self.count
+        else:
+            mean = None
+
+        buckets = []
+
+        for bound, count in zip(self.bounds + [None], self.counts):
+            if count:
+                buckets.append([bound, count])
+
+        return {
+            'count': self.count,
+            'mean': mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': buckets,
+        }
+
+class StartupStats(object):
+    """Histograms of engine startup phases by engine type and method. """
+
+    phases = ['interpreter', 'imports', 'namespace', 'server', 'code', 'total']
+
+    def __init__(self):
+        self.histograms = {}
+
+    @classmethod
+    def instance(cls):
+        """Returns the global :class:`StartupStats` instance. """
+        if not hasattr(cls, '_instance'):
+            cls._instance = cls()
+        return cls._instance
+
+    def add(self, name, method, profile):
+        """Record startup profile of an engine (``method`` is 'exec' or 'fork'). """
+        try:
+            histograms = self.histograms[name, method]
+        except KeyError:
+            histograms = self.histograms[name, method] = {}
+
+            for phase in self.phases:
+                histograms[phase] = Histogram()
+
+        for phase, histogram in histograms.iteritems():
+            value = profile.get(phase)
+
+            if value is not None:
+                histogram.add(value)
+
+    def get_stat(self):
+        """Get statistics of all startup phases. """
+        stat = {}
+
+        for (name, method), histograms in self.histograms.iteritems():
+            phases = dict([ (phase, histogram.get_stat()) for phase, histogram in histograms.iteritems() ])
+            stat.setdefault(name, {})[method] = phases
+
+        return stat
@@ -2,14 +2,35 @@
 
 import uuid
 
+from datetime import datetime
+
 from django.db import models
 from django.contrib.auth.models import User
 
-SCHEMA = 1
+SCHEMA = 3
 
 MAX_UUID = 32
 MAX_NAME = 200
 
+POSITION_GAP = 1024
+
+def get_position(lower, upper):
+    """Return a position between ``lower`` and ``upper`` or ``None``.
+
+    Either bound can be ``None`` (beginning or end of a worksheet). If
+    there is no room left between the bounds, cells must be renumbered.
+    """
+    if lower is None and upper is None:
+        return POSITION_GAP
+    elif upper is None:
+        return lower + POSITION_GAP
+    elif lower is None:
+        return upper - POSITION_GAP
+    elif upper - lower > 1:
+        return (lower + upper) // 2
+    else:
+        return None
+
 class UUIDField(models.CharField):
     """A field that stores a universally unique identifier. """
 
@@ -59,15 +80,29 @@ class Worksheet(models.Model):
     modified = models.DateTimeField(auto_now=True)
     published = models.DateTimeField(null=True, default=None)
     engine = models.ForeignKey(Engine)
-    order = models.TextField(default='')
+    revision = models.IntegerField(default=0)
+
+    def update_fields(self, **fields):
+        """Store only the given fields (and ``modified``) of this worksheet.
+
+        Unlike ``save()``, this doesn't overwrite other fields (notably
+        ``revision``) with values that may be stale by now.
+        """
+        fields['modified'] = datetime.now()
+        Worksheet.objects.filter(pk=self.pk).update(**fields)
+
+        for name, value in fields.iteritems():
+            setattr(self, name, value)
 
-    def get_order(self):
-        """Return ``order`` as a list. """
-        return self.order.split(',')
+    def bump_revision(self):
+        """Atomically increment ``revision`` and return its new value. """
+        self.update_fields(revision=models.F('revision') + 1)
+        self.revision = Worksheet.objects.filter(pk=self.pk).values_list('revision', flat=True)[0]
+        return self.revision
 
-    def set_order(self, order):
-        """Set ``order`` from a list. """
-        self.order = ','.join(order)
+    def get_cells(self):
+        """Return cells of this worksheet in order. """
+        return Cell.objects.filter(worksheet=self, position__isnull=False).order_by('position')
 
 class Cell(models.Model):
     uuid = UUIDField()
@@ -79,4 +114,5 @@ class Cell(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
     collapsed = models.BooleanField(default=False)
+    position = models.IntegerField(null=True, default=None)
 
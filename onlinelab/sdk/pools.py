@@ -0,0 +1,208 @@
+"""Pools of pre-started (warm) engine processes. """
+
+import time
+import uuid
+import logging
+import collections
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from .runner import EngineRunner
+
+from ..utils import Args
+from ..utils.settings import Settings
+
+def _get_manager():
+    from .processes import ProcessManager
+    return ProcessManager.instance()
+
+class EnginePool(object):
+    """Keep a number of idle, already booted engines of one type.
+
+    A pool acts as a manager for its own engines until they are handed
+    out, so that :class:`EngineRunner` and :class:`EngineProcess` can
+    register and unregister themselves the usual way. The pool grows
+    (up to ``max_size``) on misses and shrinks (down to ``min_size``)
+    when idle engines exceed ``ttl`` seconds.
+    """
+
+    def __init__(self, name, min_size, max_size, ttl):
+        self.ioloop = IOLoop.instance()
+
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.ttl = ttl
+
+        self.target = min_size
+        self.processes = {}
+        self.idle = collections.deque()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def starting(self):
+        """Number of engines that are still booting. """
+        return len(self.processes) - len(self.idle)
+
+    def set_process(self, uuid, process):
+        """Substitute engine runner with an engine process. """
+        self.processes[uuid] = process
+        _get_manager().track(process.pid)
+
+    def del_process(self, uuid):
+        """Remove engine runner/process from the pool. """
+        _get_manager().untrack(self.processes.pop(uuid).pid)
+
+        self.idle = collections.deque([ (_uuid, since)
+            for _uuid, since in self.idle if _uuid != uuid ])
+
+    def refill(self):
+        """Start new engines until the pool reaches its target size. """
+        for i in xrange(self.target - len(self.processes)):
+            _uuid = uuid.uuid4().hex
+            args = Args(engine={'name': self.name})
+
+            def okay(result, uuid=_uuid):
+                self.idle.append((uuid, time.time()))
+
+            def fail(error):
+                logging.warning("Failed to start pooled '%s' engine (%s)" % (self.name, error))
+
+            runner = EngineRunner(self, _uuid, args, okay, fail)
+            self.processes[_uuid] = runner
+            runner.start()
+
+    def acquire(self, manager, uuid):
+        """Hand out an idle engine process or return ``None``. """
+        while self.idle:
+            _uuid, _ = self.idle.popleft()
+            process = self.processes.pop(_uuid)
+
+            # From now on, the manager registers it as an engine.
+            manager.untrack(process.pid)
+
+            if process.is_dead:
+                continue
+
+            process.manager = manager
+            process.uuid = uuid
+
+            self.hits += 1
+            break
+        else:
+            process = None
+
+            self.misses += 1
+            self.target = min(self.target + 1, self.max_size)
+
+        self.ioloop.add_callback(self.refill)
+        return process
+
+    def expire(self):
+        """Stop engines that were idle for too long or died. """
+        for _uuid, _ in list(self.idle):
+            if self.processes[_uuid].is_dead:
+                self.del_process(_uuid)
+
+        if self.ttl <= 0:
+            return
+
+        deadline = time.time() - self.ttl
+
+        while len(self.idle) > self.min_size:
+            _uuid, since = self.idle[0]
+            process = self.processes[_uuid]
+
+            if since > deadline:
+                break
+
+            logging.info("Stopping idle pooled '%s' engine (pid=%s)" % (self.name, process.pid))
+
+            self.idle.popleft()
+            self.target = max(self.target - 1, self.min_size)
+
+            process.stop(Args(), lambda result: None, lambda error: None)
+
+    def killall(self):
+        """Forcibly kill all processes that belong to this pool. """
+        for uuid, process in self.processes.iteritems():
+            logging.warning("Forced kill of pooled %s (pid=%s)" % (uuid, process.pid))
+            process.kill()
+
+    def get_stat(self):
+        """Return hit/miss counters and sizes of this pool. """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'idle': len(self.idle),
+            'starting': self.starting,
+            'target': self.target,
+        }
+
+class EnginePools(object):
+    """Collection of engine pools, one per engine type. """
+
+    def __init__(self):
+        self.settings = Settings.instance()
+        self.pools = {}
+
+        for name in self.settings.pool_engines:
+            if name not in self.settings.engines:
+                logging.warning("Can't pool unknown engine '%s'" % name)
+                continue
+
+            self.pools[name] = EnginePool(name,
+                self.settings.pool_min_size,
+                self.settings.pool_max_size,
+                self.settings.pool_idle_ttl)
+
+        self.reaper = None
+
+    def start(self):
+        """Fill all pools and start periodic expiration of idle engines. """
+        for pool in self.pools.itervalues():
+            pool.refill()
+
+        if self.pools:
+            interval = max(self.settings.pool_idle_ttl/2, 1)
+            self.reaper = PeriodicCallback(self.expire, 1000*interval)
+            self.reaper.start()
+
+    def expire(self):
+        """Stop engines that were idle for too long in all pools. """
+        for pool in self.pools.itervalues():
+            pool.expire()
+
+    def acquire(self, manager, uuid, args):
+        """Get an idle engine matching ``args`` (if any). """
+        engine = args.get('engine')
+
+        if engine is None:
+            name = 'python'
+        elif isinstance(engine, basestring):
+            name = engine
+        elif isinstance(engine, dict) and set(engine) <= set(['name', 'code']) and engine.get('code') is None:
+            name = engine.get('name', 'python')
+        else:
+            return None
+
+        try:
+            pool = self.pools[name.lower()]
+        except (KeyError, AttributeError):
+            return None
+        else:
+            return pool.acquire(manager, uuid)
+
+    def killall(self):
+        """Forcibly kill all processes in all pools. """
+        if self.reaper is not None:
+            self.reaper.stop()
+
+        for pool in self.pools.itervalues():
+            pool.killall()
+
+    def get_stat(self):
+        """Return statistics of all pools. """
+        return dict([ (name, pool.get_stat()) for name, pool in self.pools.iteritems() ])
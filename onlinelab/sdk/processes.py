@@ -2,23 +2,41 @@
 
 import os
 import sys
+import time
 import uuid
 import logging
+import collections
 
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+import psutil
 
 from .runner import EngineRunner
+from .pools import EnginePools
+from .zygotes import Zygotes
 
 from ..utils.settings import Settings
+from ..utils import Args
 
 class ProcessManager(object):
     """Start and manage system processes for engines. """
 
+    MAX_EVICTED = 1000
+
     def __init__(self):
         self.ioloop = IOLoop.instance()
         self.settings = Settings.instance()
 
         self.processes = {}
+        self.pools = EnginePools()
+
+        self.evicted = {}
+        self.evicted_order = collections.deque()
+
+        self.evictions = {'idle': 0, 'memory': 0}
+        self.reaper = None
+
+        self.worker = None
 
     @classmethod
     def instance(cls):
@@ -31,8 +49,29 @@ class ProcessManager(object):
     def new_uuid(cls):
         return uuid.uuid4().hex
 
+    def warmup(self):
+        """Start fork servers and fill pools of pre-started engines. """
+        Zygotes.instance().start()
+        self.pools.start()
+
+        if self.settings.reap_interval > 0:
+            self.reaper = PeriodicCallback(self.reap, 1000*self.settings.reap_interval)
+            self.reaper.start()
+
     def add_process(self, uuid, args, okay, fail):
         """Start new engine process using engine runner. """
+        process = self.pools.acquire(self, uuid, args)
+
+        if self.worker is not None:
+            self.worker.register(uuid, process.pid if process is not None else None)
+
+        if process is not None:
+            process.touch()
+            self.processes[uuid] = process
+            logging.info("Using pooled engine process (pid=%s)" % process.pid)
+            okay({'status': 'started', 'uuid': uuid, 'memory': process.get_memory()})
+            return
+
         runner = EngineRunner(self, uuid, args, okay, fail)
         self.processes[uuid] = runner
         runner.start()
@@ -41,27 +80,42 @@ class ProcessManager(object):
         """Substitute engine runner with an engine process. """
         self.processes[uuid] = process
 
+        if self.worker is not None:
+            self.worker.register(uuid, process.pid)
+
     def del_process(self, uuid):
         """Remove engine runner/process from the store. """
         del self.processes[uuid]
 
+        # Evicted engines stay registered, so that other workers route
+        # requests for them here and clients learn they were evicted.
+        if self.worker is not None and uuid not in self.evicted:
+            self.worker.unregister(uuid)
+
     def start(self, uuid, args, okay, fail):
         """Start a new engine instance (start a new process). """
         try:
             process = self.processes[uuid]
         except KeyError:
+            self.forget_evicted(uuid)
             self.add_process(uuid or self.new_uuid(), args, okay, fail)
         else:
-            if process.is_starting():
+            if process.is_starting:
                 fail('starting')
             elif process.is_dead:
                 self.del_process(uuid)
-                fail('died')
+                fail(process.reason or 'died')
+            elif uuid in self.evicted:
+                fail('terminating')
             else:
                 fail('running')
 
     def stop(self, uuid, args, okay, fail):
         """Stop an existing engine instance (kill a process). """
+        if uuid in self.evicted:
+            fail('evicted')
+            return
+
         try:
             process = self.processes[uuid]
         except KeyError:
@@ -70,6 +124,10 @@ class ProcessManager(object):
             process.stop(args, okay, fail)
 
     def _apply_process(self, uuid, method, args, okay, fail):
+        if uuid in self.evicted:
+            fail('evicted')
+            return
+
         try:
             process = self.processes[uuid]
         except KeyError:
@@ -79,13 +137,105 @@ class ProcessManager(object):
                 fail('starting')
             elif process.is_dead:
                 self.del_process(uuid)
-                fail('died')
+                fail(process.reason or 'died')
             else:
+                if method != 'stat':
+                    process.touch()
+
                 getattr(process, method)(args, okay, fail)
 
+    def evict(self, process, reason):
+        """Stop an engine and remember why, so that clients can be told. """
+        logging.info("Evicting %s (pid=%s, reason=%s)" % (process.uuid, process.pid, reason))
+
+        self.evicted[process.uuid] = reason
+        self.evicted_order.append(process.uuid)
+        self.evictions[reason] += 1
+
+        # Keep the engine registered, but its PID may be reused soon.
+        if self.worker is not None:
+            self.worker.register(process.uuid, None)
+
+        while len(self.evicted_order) > self.MAX_EVICTED:
+            self.forget_evicted(self.evicted_order[0])
+
+        process.stop(Args(), lambda result: None, lambda error: None)
+
+    def forget_evicted(self, uuid):
+        """Stop reporting engine ``uuid`` as evicted. """
+        if self.evicted.pop(uuid, None) is None:
+            return
+
+        self.evicted_order.remove(uuid)
+
+        if self.worker is not None and uuid not in self.processes:
+            self.worker.unregister(uuid)
+
+    def track(self, pid):
+        """Record a process (not an engine) that this worker started. """
+        if self.worker is not None and pid is not None:
+            self.worker.track(pid)
+
+    def untrack(self, pid):
+        """Forget a process recorded with :meth:`track`. """
+        if self.worker is not None and pid is not None:
+            self.worker.untrack(pid)
+
+    def reap(self):
+        """Stop engines idle for too long or exceeding the memory budget.
+
+        Only engines that aren't evaluating and have nothing queued are
+        considered. When the total RSS of all engines exceeds the budget,
+        least recently used ones are evicted until it fits again.
+        """
+        idle = [ process for process in self.processes.itervalues()
+            if not process.is_starting and process.uuid not in self.evicted and process.is_idle ]
+
+        ttl = self.settings.engine_idle_ttl
+
+        if ttl > 0:
+            deadline = time.time() - ttl
+
+            for process in list(idle):
+                if process.last_used < deadline:
+                    self.evict(process, 'idle')
+                    idle.remove(process)
+
+        budget = self.settings.engine_memory_budget
+
+        if budget > 0 and idle:
+            memory, total = {}, 0
+
+            for uuid, process in self.processes.iteritems():
+                if process.is_starting or process.is_dead or uuid in self.evicted:
+                    continue
+
+                try:
+                    memory[uuid] = process.get_memory()
+                except psutil.NoSuchProcess:
+                    continue
+
+                total += memory[uuid]
+
+            if total > budget:
+                for process in sorted(idle, key=lambda process: process.last_used):
+                    if total <= budget:
+                        break
+
+                    self.evict(process, 'memory')
+                    total -= memory.get(process.uuid, 0)
+
+                if total > budget:
+                    logging.warning("Engines use %d bytes of memory (budget is %d bytes)" % (total, budget))
+
     def stat(self, uuid, args, okay, fail):
         """Gather data about an engine process. """
-        self._apply_process(uuid, 'stat', args, okay, fail)
+        def _okay(result):
+            result['pools'] = self.pools.get_stat()
+            result['evictions'] = dict(self.evictions)
+            okay(result)
+
+        self._apply_process(uuid, 'stat', args, _okay, fail)
 
     def complete(self, uuid, args, okay, fail):
         """Complete a piece of source code. """
@@ -95,13 +245,30 @@ class ProcessManager(object):
         """Evaluate a piece of source code. """
         self._apply_process(uuid, 'evaluate', args, okay, fail)
 
+    def stream(self, uuid, args, okay, fail):
+        """Wait for streamed output of an evaluation. """
+        self._apply_process(uuid, 'stream', args, okay, fail)
+
+    def output(self, uuid, args, okay, fail):
+        """Read a page of full output of an evaluation. """
+        self._apply_process(uuid, 'output', args, okay, fail)
+
     def interrupt(self, uuid, args, okay, fail):
         """Stop evaluation of specified requests. """
         self._apply_process(uuid, 'interrupt', args, okay, fail)
 
     def killall(self):
         """Forcibly kill all processes that belong to this manager. """
+        if self.reaper is not None:
+            self.reaper.stop()
+
+        if self.worker is not None:
+            self.worker.stop()
+
         for uuid, process in self.processes.iteritems():
             logging.warning("Forced kill of %s (pid=%s)" % (uuid, process.pid))
             process.kill()
 
+        self.pools.killall()
+        Zygotes.instance().killall()
+
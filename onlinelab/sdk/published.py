@@ -0,0 +1,54 @@
+"""Cache of rendered pages and cells of published worksheets. """
+
+from ..utils.cache import LRUCache
+from ..utils.settings import Settings
+
+class PublishedCache(object):
+    """Rendered pages and cell payloads keyed by worksheet and its version.
+
+    Keys include ``Worksheet.modified``, so a cached value can't outlive
+    a change of a worksheet, even if it was made by another SDK worker.
+    Worksheets are also invalidated explicitly when saved, to free the
+    memory early and not to depend on resolution of timestamps.
+    """
+
+    def __init__(self):
+        self.settings = Settings.instance()
+        self.cache = LRUCache(self.settings.published_cache_size)
+
+    @classmethod
+    def instance(cls):
+        """Returns the global :class:`PublishedCache` instance. """
+        if not hasattr(cls, '_instance'):
+            cls._instance = cls()
+        return cls._instance
+
+    def get(self, uuid, modified, part):
+        """Return cached ``part`` of a worksheet or ``None``. """
+        return self.cache.get((uuid, modified, part))
+
+    def put(self, uuid, modified, part, value, size):
+        """Store ``part`` (of approximately ``size`` bytes) of a worksheet. """
+        self.cache.put((uuid, modified, part), value, size)
+
+    def invalidate(self, uuid):
+        """Remove all cached parts of a worksheet. """
+        for key in [ key for key in self.cache.entries if key[0] == uuid ]:
+            self.cache.discard(key)
+
+    def get_index(self, version):
+        """Return cached list of published worksheets or ``None``. """
+        return self.cache.get((None, version, 'index'))
+
+    def put_index(self, version, value, size):
+        """Store list of published worksheets at the given ``version``. """
+        self.invalidate_index()
+        self.cache.put((None, version, 'index'), value, size)
+
+    def invalidate_index(self):
+        """Remove cached list of published worksheets. """
+        self.invalidate(None)
+
+    def get_stat(self):
+        """Return statistics of the underlying cache. """
+        return self.cache.get_stat()
@@ -0,0 +1,290 @@
+"""Shared engine registry for running SDK in multiple worker processes. """
+
+import os
+import errno
+import socket
+import sqlite3
+import logging
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from .transports import FramedTransport
+
+from ..engines.utils.framed import HEADER, encode_frame, decode_frame
+from ..utils import Args
+
+class EngineRegistry(object):
+    """Map of engines to SDK workers that own them, stored in SQLite.
+
+    Engine processes are children of the worker that started them (it
+    reads their output and holds their transports), so requests for an
+    engine have to be handled by its owner. All workers share this map
+    to find out where to forward requests.
+
+    Other processes of workers (fork servers and pooled engines) are
+    recorded too, so that they can be killed if their worker crashes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.db.execute("CREATE TABLE IF NOT EXISTS engines (uuid TEXT PRIMARY KEY, worker TEXT NOT NULL, pid INTEGER)")
+
+        columns = [ row[1] for row in self.db.execute("PRAGMA table_info(engines)") ]
+
+        if 'pid' not in columns:
+            self.db.execute("ALTER TABLE engines ADD COLUMN pid INTEGER")
+
+        self.db.execute("CREATE TABLE IF NOT EXISTS processes (pid INTEGER PRIMARY KEY, worker TEXT NOT NULL)")
+
+    def register(self, uuid, worker, pid=None):
+        """Record that ``worker`` owns engine ``uuid`` (process ``pid``). """
+        self.db.execute("INSERT OR REPLACE INTO engines VALUES (?, ?, ?)", (uuid, worker, pid))
+
+    def unregister(self, uuid, worker):
+        """Forget engine ``uuid`` (if it is still owned by ``worker``). """
+        self.db.execute("DELETE FROM engines WHERE uuid = ? AND worker = ?", (uuid, worker))
+
+    def lookup(self, uuid):
+        """Return address of the worker that owns engine ``uuid``. """
+        row = self.db.execute("SELECT worker FROM engines WHERE uuid = ?", (uuid,)).fetchone()
+
+        if row is not None:
+            return row[0]
+        else:
+            return None
+
+    def track(self, pid, worker):
+        """Record that ``worker`` owns process ``pid`` (not an engine). """
+        self.db.execute("INSERT OR REPLACE INTO processes VALUES (?, ?)", (pid, worker))
+
+    def untrack(self, pid):
+        """Forget process ``pid`` (e.g. after it exited). """
+        self.db.execute("DELETE FROM processes WHERE pid = ?", (pid,))
+
+    def pids(self, worker):
+        """Return PIDs of all processes (engines and others) of ``worker``. """
+        rows = self.db.execute("SELECT pid FROM engines WHERE worker = ? AND pid IS NOT NULL "
+                               "UNION SELECT pid FROM processes WHERE worker = ?", (worker, worker))
+        return [ row[0] for row in rows ]
+
+    def purge(self, worker):
+        """Forget all engines and processes of a worker (e.g. after it exited). """
+        self.db.execute("DELETE FROM engines WHERE worker = ?", (worker,))
+        self.db.execute("DELETE FROM processes WHERE worker = ?", (worker,))
+
+    def clear(self):
+        """Forget all engines and processes. """
+        self.db.execute("DELETE FROM engines")
+        self.db.execute("DELETE FROM processes")
+
+    def close(self):
+        """Close connection to the database. """
+        self.db.close()
+
+class PeerConnection(object):
+    """Connection from another worker forwarding engine requests. """
+
+    def __init__(self, worker, stream):
+        self.worker = worker
+        self.stream = stream
+
+        self._read_header()
+
+    def _read_header(self):
+        self.stream.read_bytes(HEADER.size, self._on_header)
+
+    def _on_header(self, data):
+        size, = HEADER.unpack(data)
+        self.stream.read_bytes(size, self._on_frame)
+
+    def _on_frame(self, data):
+        self._read_header()
+
+        try:
+            request = decode_frame(data)
+            id, method, (params,) = request['id'], request['method'], request['params']
+        except (ValueError, KeyError, TypeError):
+            logging.error("Worker: invalid request from a peer")
+            self.stream.close()
+            return
+
+        def okay(result):
+            self.respond(id, {'okay': result})
+
+        def fail(error=None):
+            self.respond(id, {'fail': error})
+
+        if method not in self.worker.methods:
+            fail('bad-method')
+        else:
+            manager = self.worker.manager
+            getattr(manager, method)(params['uuid'], Args(params['args']), okay, fail)
+
+    def respond(self, id, result):
+        """Send result of a forwarded request back to a peer. """
+        if not self.stream.closed():
+            self.stream.write(encode_frame({'id': id, 'result': result}))
+
+class Worker(object):
+    """SDK worker process that routes requests to owners of engines.
+
+    Requests for engines that this worker owns (or that aren't owned
+    by anyone) are handled locally, the rest is forwarded over a Unix
+    socket to the owner, which handles them with its own
+    :class:`ProcessManager`.
+    """
+
+    methods = ['start', 'stop', 'stat', 'complete', 'evaluate', 'stream', 'output', 'interrupt']
+
+    def __init__(self, manager, registry, path):
+        self.ioloop = IOLoop.instance()
+
+        self.manager = manager
+        self.registry = registry
+        self.path = path
+
+        self.socket = None
+        self.peers = {}
+        self.owners = {}
+
+    @classmethod
+    def get_path(cls, data_path, pid):
+        """Return path to a Unix socket of a worker. """
+        return os.path.join(data_path, 'workers', '%d.sock' % pid)
+
+    def start(self):
+        """Listen for requests forwarded by other workers. """
+        directory = os.path.dirname(self.path)
+
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self.registry.purge(self.path)
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.setblocking(0)
+        self.socket.bind(self.path)
+        self.socket.listen(128)
+
+        self.ioloop.add_handler(self.socket.fileno(), self._on_accept, self.ioloop.READ)
+
+    def stop(self):
+        """Stop listening and forget engines owned by this worker. """
+        if self.socket is not None:
+            self.ioloop.remove_handler(self.socket.fileno())
+            self.socket.close()
+            self.socket = None
+
+            os.unlink(self.path)
+
+        self.registry.purge(self.path)
+
+        for transport in self.peers.itervalues():
+            transport.close()
+
+    def _on_accept(self, fd, events):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except socket.error as exc:
+                if exc.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return
+                raise
+
+            conn.setblocking(0)
+            PeerConnection(self, IOStream(conn, self.ioloop))
+
+    def register(self, uuid, pid=None):
+        """Announce that this worker owns engine ``uuid``. """
+        self.registry.register(uuid, self.path, pid)
+
+    def unregister(self, uuid):
+        """Announce that engine ``uuid`` is gone. """
+        self.registry.unregister(uuid, self.path)
+
+    def track(self, pid):
+        """Announce that this worker started process ``pid``. """
+        self.registry.track(pid, self.path)
+
+    def untrack(self, pid):
+        """Announce that process ``pid`` is gone. """
+        self.registry.untrack(pid)
+
+    def call(self, method, uuid, args, okay, fail):
+        """Call ``method`` of engine ``uuid`` locally or in its owner. """
+        if uuid is None or uuid in self.manager.processes:
+            owner = None
+        else:
+            owner = self.lookup(uuid)
+
+        if owner is None or owner == self.path:
+            getattr(self.manager, method)(uuid, args, okay, fail)
+        else:
+            self.forward(owner, method, uuid, args, okay, fail)
+
+    def lookup(self, uuid):
+        """Find the owner of engine ``uuid`` (cached, to avoid hitting
+        the database on every request). """
+        try:
+            return self.owners[uuid]
+        except KeyError:
+            owner = self.registry.lookup(uuid)
+
+            if owner is not None:
+                self.owners[uuid] = owner
+
+            return owner
+
+    def forward(self, owner, method, uuid, args, okay, fail, retry=True):
+        """Send a request to the worker that owns an engine. """
+        try:
+            transport = self.peers[owner]
+        except KeyError:
+            transport = self.peers[owner] = FramedTransport(owner)
+
+        def _okay(result):
+            if 'fail' in result:
+                error = result['fail']
+
+                if error == 'does-not-exist' and self.owners.pop(uuid, None) is not None:
+                    # The engine might have moved to another worker since
+                    # we cached its owner, so look it up once again.
+                    current = self.lookup(uuid)
+
+                    if retry and current is not None and current != owner:
+                        if current == self.path:
+                            getattr(self.manager, method)(uuid, args, okay, fail)
+                        else:
+                            self.forward(current, method, uuid, args, okay, fail, False)
+                        return
+
+                fail(error)
+            else:
+                if method == 'stop':
+                    self.owners.pop(uuid, None)
+
+                okay(result['okay'])
+
+        def _fail(error):
+            logging.warning("Can't forward '%s' to worker %s (%s)" % (method, owner, error))
+
+            if self.peers.get(owner) is transport:
+                del self.peers[owner]
+                transport.close()
+
+            for engine, worker in self.owners.items():
+                if worker == owner:
+                    del self.owners[engine]
+
+            fail('worker-unavailable')
+
+        transport.call(method, {'uuid': uuid, 'args': args}, _okay, _fail)
@@ -4,9 +4,9 @@ import re
 import os
 import sys
 import time
+import json
 import fcntl
 import shutil
-import socket
 import logging
 
 from subprocess import Popen, PIPE
@@ -14,6 +14,10 @@ from tornado.ioloop import IOLoop
 
 from .base import EngineBase
 from .engine import EngineProcess
+from .zygotes import Zygotes
+from .limits import EngineLimits, LimitsError
+from .transports import transports, get_transport
+from .metrics import StartupStats
 
 from ..utils.settings import Settings
 
@@ -23,10 +27,51 @@ class RunnerError(Exception):
     def __init__(self, error):
         self.error = error
 
+def build_env(settings, home):
+    """Create an hardened environment for a process living in ``home``. """
+    if settings.environ is True:
+        env = dict(os.environ)
+    else:
+        env = {}
+
+        for key, value in settings.environ.iteritems():
+            if value is True:
+                try:
+                    value = os.environ[key]
+                except KeyError:
+                    continue
+
+            env[key] = value
+
+    PYTHONPATH = settings.get_PYTHONPATH()
+
+    try:
+        path = env['PYTHONPATH']
+    except KeyError:
+        try:
+            path = os.environ['PYTHONPATH']
+        except KeyError:
+            path = None
+
+    if path:
+        PYTHONPATH += os.pathsep + path
+
+    env['PYTHONPATH'] = PYTHONPATH
+
+    # As we know the home directory for our process, lets now hack Python's
+    # site.py and tell it where is should look for extra modules (.local)
+    # and make some other modules happy (e.g. matplotlib).
+
+    env['HOME'] = env['PYTHONUSERBASE'] = home
+
+    return env
+
 class EngineRunner(EngineBase):
     """A class for starting engine processes. """
 
-    _re = re.compile(r"^.*?OK \(pid=(?P<pid>\d+)\)")
+    max_socket_path = 100
+
+    _re = re.compile(r"^.*?OK \(pid=(?P<pid>\d+)(?:, port=(?P<port>\d+))?\)(?: (?P<profile>\{.*?\}))?")
 
     def __init__(self, manager, uuid, args, okay, fail):
         self.settings = Settings.instance()
@@ -40,6 +85,7 @@ class EngineRunner(EngineBase):
         self.timeouted = False
         self.terminating = False
         self.preexec_fn = None
+        self.limits = None
 
     @property
     def pid(self):
@@ -75,23 +121,36 @@ class EngineRunner(EngineBase):
         try:
             self.setup_engine()
             self.setup_cwd()
+            self.setup_address()
             self.setup_env()
-            self.setup_process()
-            self.setup_pipes()
-            self.setup_handlers()
+            self.setup_limits()
         except RunnerError as exc:
-            self.manager.del_process(self.uuid)
-            self.fail(exc.error)
+            self.abort(exc.error)
+        else:
+            self.setup_process()
+
+    def abort(self, error):
+        """Give up starting an engine. """
+        if self.limits is not None:
+            self.limits.cleanup()
+
+        self.manager.del_process(self.uuid)
+        self.fail(error)
 
     def stop(self, args, okay, fail):
         """Terminate a starting engine process. """
-        self.process.terminate()
+        if self.process is not None:
+            self.process.terminate()
+
         self.terminating = True
         okay('terminated')
 
     def kill(self):
         """Kill a starting engine process. """
-        self.process.kill()
+        if self.process is not None:
+            self.process.kill()
+        else:
+            self.terminating = True
 
     @classmethod
     def set_nonblocking(cls, fd, nonblocking=True):
@@ -105,16 +164,6 @@ class EngineRunner(EngineBase):
 
         fcntl.fcntl(fd, fcntl.F_SETFL, fl)
 
-    @classmethod
-    def find_port(cls):
-        """Find a free socket port. """
-        sock = socket.socket()
-        sock.bind(('', 0))
-        port = sock.getsockname()[1]
-        sock.close()
-        del sock
-        return port
-
     def _get_engine(self, args):
         """Return engine metadata. """
         if 'engine' in args:
@@ -131,7 +180,7 @@ class EngineRunner(EngineBase):
         return {'name': 'python'}
 
     def setup_engine(self):
-        """Build engine startup command-line. """
+        """Determine engine's type, startup code and transport. """
         engine = self._get_engine(self.args)
         namespace = {}
 
@@ -148,15 +197,18 @@ class EngineRunner(EngineBase):
         except ImportError:
             raise RunnerError('bad-engine')
 
-        self.port = self.find_port()
-        builder = namespace['builder']
+        transport = engine.get('transport')
 
-        try:
-            code = engine['code']
-        except KeyError:
-            code = None
+        if transport is None:
+            transport = self.settings.transports.get(name, 'xmlrpc')
 
-        self.command = builder(self.port, code)
+        if transport not in transports:
+            raise RunnerError('bad-transport')
+
+        self.name = name
+        self.code = engine.get('code')
+        self.transport = transport
+        self.builder = namespace['builder']
 
     def setup_cwd(self):
         """Create a working directory for an engine. """
@@ -171,52 +223,98 @@ class EngineRunner(EngineBase):
 
         os.mkdir(cwd)
 
-    def setup_env(self):
-        """Create an hardened environment for an engine. """
-        if self.settings.environ is True:
-            self.env = env = dict(os.environ)
+    def setup_address(self):
+        """Choose an address for an engine and build its command-line. """
+        path = os.path.join(self.cwd, 'engine.sock')
+
+        # Unix sockets are preferred, because there is no need to find a free
+        # port (which is racy) and they are faster than TCP on loopback. Paths
+        # of Unix sockets are limited to about 100 characters, though. Port 0
+        # tells the engine to listen on any free port and report it back.
+
+        if self.transport == 'framed':
+            if len(path) >= self.max_socket_path:
+                raise RunnerError('socket-path-too-long')
+            self.address = path
+        elif self.settings.engine_socket == 'unix' and len(path) < self.max_socket_path:
+            self.address = path
         else:
-            self.env = env = {}
+            self.address = 0
 
-            for key, value in self.settings.environ.iteritems():
-                if value is True:
-                    try:
-                        value = os.environ[key]
-                    except KeyError:
-                        continue
+        self.command = self.builder(self.address, self.code, self.transport)
 
-                env[key] = value
+    def setup_env(self):
+        """Create an hardened environment for an engine. """
+        self.env = build_env(self.settings, self.cwd)
 
-        PYTHONPATH = self.settings.get_PYTHONPATH()
+    def setup_limits(self):
+        """Prepare resource limits configured for engine's type. """
+        self.limits = EngineLimits(self.name, self.uuid)
 
         try:
-            path = env['PYTHONPATH']
-        except KeyError:
-            try:
-                path = os.environ['PYTHONPATH']
-            except KeyError:
-                path = None
+            self.limits.setup()
+        except LimitsError as exc:
+            logging.error("Can't limit '%s' engine (%s)" % (self.name, exc))
+            raise RunnerError('bad-limits')
 
-        if path:
-            PYTHONPATH += os.pathsep + path
+        self.preexec_fn = self.limits.preexec_fn
 
-        env['PYTHONPATH'] = PYTHONPATH
+    def setup_process(self):
+        """Create an engine process (fork it or start from scratch). """
+        zygote = Zygotes.instance().get(self.name)
+
+        self.spawned = time.time()
 
-        # As we know the home directory for our engine, lets now hack Python's
-        # site.py and tell it where is should look for extra modules (.local)
-        # and make some other modules happy (e.g. matplotlib).
+        if zygote is not None:
+            zygote.spawn(self.cwd, self.env,
+                {'address': self.address, 'code': self.code, 'transport': self.transport},
+                self.limits.spec, self._on_forked, self._on_fork_failed)
+        else:
+            self.exec_process()
 
-        env['HOME'] = env['PYTHONUSERBASE'] = self.cwd
+    def _on_forked(self, process):
+        """Gets executed when a zygote forked an engine for us. """
+        self.method = 'fork'
+        self.process = process
+
+        if self.terminating:
+            self.process.terminate()
+
+        self.setup_io()
+
+    def _on_fork_failed(self, error):
+        """Gets executed when a zygote couldn't fork an engine. """
+        logging.warning("Can't fork '%s' engine (%s)" % (self.name, error))
+
+        if self.terminating:
+            self.limits.cleanup()
+            self.manager.del_process(self.uuid)
+            self.okay('terminated')
+        else:
+            self.exec_process()
+
+    def exec_process(self):
+        """Start an engine process from scratch. """
+        self.method = 'exec'
 
-    def setup_process(self):
-        """Create an engine process. """
         # Lets start the engine's process. We must close all non-standard file
         # descriptors (via 'close_fds'), because otherwise IOLoop will hang.
         # When the process will be ready to handle requests from the client, it
         # will tell us this by sending a single line of well formatted output.
 
-        self.process = Popen(self.command, preexec_fn=self.preexec_fn, cwd=self.cwd,
-            env=self.env, close_fds=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        try:
+            self.process = Popen(self.command, preexec_fn=self.preexec_fn, cwd=self.cwd,
+                env=self.env, close_fds=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        except (IOError, OSError, ValueError) as exc:
+            logging.error("Can't start '%s' engine (%s)" % (self.name, exc))
+            self.abort('spawn-failed')
+        else:
+            self.setup_io()
+
+    def setup_io(self):
+        """Start communicating with a freshly spawned process. """
+        self.setup_pipes()
+        self.setup_handlers()
 
     def setup_pipes(self):
         """Make sure that stdout and stderr are non-blocking. """
@@ -267,13 +365,16 @@ class EngineRunner(EngineBase):
 
         self.process.wait()
 
+        reason = self.limits.get_reason(self.process.returncode)
+        self.limits.cleanup()
+
         if self.terminating:
             self.okay('terminated')
         else:
             if self.timeouted:
                 self.fail('timeout')
             else:
-                self.fail('died')
+                self.fail(reason or 'died')
 
     def _on_read(self, fd, events):
         """Get executed when starting engine communicated with us. """
@@ -289,14 +390,38 @@ class EngineRunner(EngineBase):
             return
 
         self.cleanup_handlers(fd)
+        self.record_profile(result.group('profile'))
+
+        if self.address == 0:
+            self.address = int(result.group('port'))
 
-        engine = EngineProcess(self.manager, self.uuid, self.process, self.cwd, self.port)
+        transport = get_transport(self.transport, self.address)
+        engine = EngineProcess(self.manager, self.uuid, self.process, self.cwd, transport, self.limits)
         self.manager.set_process(self.uuid, engine)
 
         logging.info("Started new engine process (pid=%s)" % engine.pid)
 
         self.okay({'status': 'started', 'uuid': self.uuid, 'memory': engine.get_memory()})
 
+    def record_profile(self, data):
+        """Add startup profile reported by an engine to statistics. """
+        profile = {'total': time.time() - self.spawned}
+
+        if data is not None:
+            try:
+                reported = json.loads(data)
+            except ValueError:
+                logging.warning("Invalid startup profile: %s" % data)
+            else:
+                started = reported.pop('started', None)
+
+                if started is not None:
+                    profile['interpreter'] = started - self.spawned
+
+                profile.update(reported)
+
+        StartupStats.instance().add(self.name, self.method, profile)
+
     def cleanup_handlers(self, fd):
         """Remove timeout and communication handlers. """
         try:
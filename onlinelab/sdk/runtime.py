@@ -3,6 +3,7 @@
 import os
 import sys
 import uuid
+import errno
 import shutil
 import signal
 import daemon
@@ -26,6 +27,9 @@ import tornado.wsgi
 import tornado.web
 
 from .processes import ProcessManager
+from .registry import EngineRegistry, Worker
+from .workers import RenderPool
+from . import highlight
 
 from ..utils import jsonrpc
 from ..utils import configure
@@ -238,6 +242,77 @@ def install(packages, args):
 
     print "Done."
 
+def _fork_workers(args):
+    """Fork SDK worker processes and supervise them.
+
+    Returns only in worker processes. The supervisor restarts workers
+    that exit unexpectedly and stops all of them on SIGTERM/SIGINT.
+    """
+    EngineRegistry(args.registry_path).clear()
+
+    workers = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+
+        if not pid:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            return True
+
+        workers.add(pid)
+        logging.info("Started SDK worker (pid=%s)" % pid)
+        return False
+
+    def terminate(signum, frame):
+        stopping.append(signum)
+
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    for i in xrange(args.workers):
+        if spawn():
+            return
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except OSError as exc:
+            if exc.errno == errno.EINTR:
+                continue
+            raise
+
+        if pid not in workers:
+            continue
+
+        workers.remove(pid)
+
+        registry = EngineRegistry(args.registry_path)
+        path = Worker.get_path(args.data_path, pid)
+
+        # Engines of a dead worker can't be reached by anyone anymore.
+        for engine in registry.pids(path):
+            try:
+                os.kill(engine, signal.SIGKILL)
+            except OSError:
+                pass
+
+        registry.purge(path)
+        registry.close()
+
+        if not stopping:
+            logging.warning("SDK worker (pid=%s) exited (status=%s), restarting" % (pid, status))
+
+            if spawn():
+                return
+
+    logging.info("Stopped SDK at localhost:%s (pid=%s)" % (args.port, os.getpid()))
+    sys.exit(0)
+
 def start(args):
     """Start an existing SDK server. """
     _setup_logging(args)
@@ -298,6 +373,10 @@ def start(args):
         modules.append((module, cls, css_files, js_files))
         logging.info("Enabled module '%s'" % module)
 
+    # Style of highlighted code is the same for all pages, so it is served
+    # as a static (cacheable) file instead of being generated per request.
+    highlight.write_css(os.path.join(args.static_path, 'css', 'highlight.css'))
+
     app_settings = {
         'modules': modules,
         'static_path': args.static_path,
@@ -315,11 +394,29 @@ def start(args):
     ], **app_settings)
 
     server = tornado.httpserver.HTTPServer(application)
-    server.listen(args.port)
+
+    if args.workers > 1:
+        # All workers accept connections on a socket bound before forking.
+        # Each worker has its own IOLoop and ProcessManager, so nothing
+        # may create them before this point.
+        server.bind(args.port)
+        _fork_workers(args)
+        server.start()
+
+        manager = ProcessManager.instance()
+
+        manager.worker = Worker(manager, EngineRegistry(args.registry_path),
+            Worker.get_path(args.data_path, os.getpid()))
+        manager.worker.start()
+    else:
+        server.listen(args.port)
 
     logging.info("Started SDK at localhost:%s (pid=%s)" % (args.port, os.getpid()))
 
+    RenderPool.instance().start()
+
     ioloop = tornado.ioloop.IOLoop.instance()
+    ioloop.add_callback(ProcessManager.instance().warmup)
 
     try:
         ioloop.start()
@@ -328,10 +425,21 @@ def start(args):
     except SystemExit:
         pass
 
+    if args.workers > 1:
+        # Ctrl+C reaches workers directly and via the supervisor, so
+        # don't let the second signal interrupt the cleanup.
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
     ProcessManager.instance().killall()
+    RenderPool.instance().stop()
 
     logging.info("Stopped SDK at localhost:%s (pid=%s)" % (args.port, os.getpid()))
 
+    if args.workers > 1:
+        # Don't run exit handlers (e.g. releasing the PID file) of the supervisor.
+        os._exit(0)
+
 def stop(args):
     """Stop a running SDK server. """
     _setup_console_logging(args)
@@ -410,7 +518,7 @@ def load(args, settings):
     """Load contents of the database from a file. """
     from django.db import IntegrityError
     from cPickle import loads
-    from schema import transform
+    from schema import transform, finalize
 
     if not args.path:
         path = settings.data_path
@@ -462,6 +570,9 @@ def load(args, settings):
             if not args.dry_run:
                 os.unlink(file_path)
 
+    if not args.dry_run:
+        finalize()
+
     print "Done."
 
 
@@ -1,6 +1,10 @@
 """Online Lab database schema transformations. """
 
-from models import SCHEMA
+from models import SCHEMA, POSITION_GAP, Cell
+from database import atomic
+
+# Orders of cells of loaded worksheets (by ``id``), see ``finalize()``.
+_orders = {}
 
 def transform(name, data, schema):
     """
@@ -34,12 +38,37 @@ def transform(name, data, schema):
 
     """
     for i in xrange(schema, SCHEMA):
-        method = getattr(globals(), 'transform_%d_%s' % (i, name), None)
+        method = globals().get('transform_%d_%s' % (i, name))
 
         if method is not None:
             method(data)
 
+@atomic
+def finalize():
+    """
+    Apply transformations that need data of more than one model.
+
+    This has to be called after all rows of all models were loaded.
+
+    """
+    for worksheet_id, order in _orders.iteritems():
+        for i, uuid in enumerate(order):
+            Cell.objects.filter(worksheet=worksheet_id, uuid=uuid).update(position=(i+1)*POSITION_GAP)
+
+    _orders.clear()
+
 def transform_0_onlinelab_sdk_models_Cell(data):
     """0 -> 1: add field 'collapsed' to 'Cell' model. """
     data['collapsed'] = False
 
+def transform_1_onlinelab_sdk_models_Worksheet(data):
+    """1 -> 2: add field 'revision' to 'Worksheet' model. """
+    data['revision'] = 0
+
+def transform_2_onlinelab_sdk_models_Worksheet(data):
+    """2 -> 3: move field 'order' of 'Worksheet' model to 'Cell.position'. """
+    _orders[data['id']] = [ uuid for uuid in data.pop('order').split(',') if uuid ]
+
+def transform_2_onlinelab_sdk_models_Cell(data):
+    """2 -> 3: add field 'position' to 'Cell' model (see finalize()). """
+    data['position'] = None
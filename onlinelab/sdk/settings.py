@@ -16,8 +16,30 @@ options = [
     ('log_actions', 'path'),
     ('auth', 'bool'),
     ('evaluate_timeout', 'int'),
+    ('output_buffer_size', 'int'),
+    ('evaluate_batch_size', 'int'),
     ('engine_timeout', 'int'),
+    ('stream_timeout', 'int'),
+    ('stream_buffer_size', 'int'),
+    ('fork_engines', 'list'),
+    ('pool_engines', 'list'),
+    ('pool_min_size', 'int'),
+    ('pool_max_size', 'int'),
+    ('pool_idle_ttl', 'int'),
+    ('engine_idle_ttl', 'int'),
+    ('engine_memory_budget', 'int'),
+    ('reap_interval', 'int'),
+    ('engine_limits', 'dict'),
+    ('cgroup_path', 'path'),
+    ('workers', 'int'),
+    ('registry_path', 'path'),
+    ('render_workers', 'int'),
+    ('render_cache_size', 'int'),
+    ('render_timeout', 'int'),
+    ('published_cache_size', 'int'),
     ('engines', 'list'),
+    ('transports', 'dict'),
+    ('engine_socket', 'str'),
     ('environ', 'dict'),
     ('modules', 'list'),
 ]
@@ -38,8 +60,30 @@ defaults = {
     'log_actions': "%(logs_path)s/actions.log",
     'auth': True,
     'evaluate_timeout': 0,             # allow oo evaluation time
+    'output_buffer_size': 1000*1000,   # keep 1 MB of output in memory
+    'evaluate_batch_size': 1,          # don't batch queued requests
     'engine_timeout': 20,              # wait at most 20 seconds
+    'stream_timeout': 30,              # hold long-polls for 30 seconds
+    'stream_buffer_size': 1000*1000,   # keep 1 MB of streamed output
+    'fork_engines': ['python'],        # fork these engines from zygotes
+    'pool_engines': ['python'],        # keep warm engines of these types
+    'pool_min_size': 1,                # at least 1 idle engine per type
+    'pool_max_size': 4,                # at most 4 idle engines per type
+    'pool_idle_ttl': 600,              # stop surplus engines after 10 minutes
+    'engine_idle_ttl': 4*60*60,        # stop engines unused for 4 hours
+    'engine_memory_budget': 0,         # bytes of RSS of all engines (0 = no limit)
+    'reap_interval': 60,               # look for engines to stop every minute
+    'engine_limits': {},               # e.g. {'*': {'cpu_time': 3600, 'memory': 2**30}}
+    'cgroup_path': None,               # cgroup v2 for 'memory', 'cpu' and 'pids' quotas
+    'workers': 1,                      # number of SDK processes sharing the port
+    'registry_path': "%(data_path)s/registry.db",
+    'render_workers': 2,               # highlight and render docs in 2 processes
+    'render_cache_size': 10*1000*1000, # keep 10 MB of rendered HTML
+    'render_timeout': 10,              # give up on rendering after 10 seconds
+    'published_cache_size': 20*1000*1000, # keep 20 MB of published worksheets
     'engines': ['python', 'python3', 'javascript'],
+    'transports': {},                  # 'xmlrpc' (default) or 'framed'
+    'engine_socket': 'unix',           # or 'tcp' (XML-RPC on localhost)
     'environ': {},
     'modules': [],
 }
@@ -0,0 +1 @@
+CREATE INDEX sdk_cell_worksheet_position ON sdk_cell (worksheet_id, position);
@@ -0,0 +1 @@
+CREATE INDEX sdk_worksheet_published ON sdk_worksheet (published);
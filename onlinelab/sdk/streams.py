@@ -0,0 +1,119 @@
+"""Incremental delivery of engine output to clients. """
+
+import time
+import collections
+
+from tornado.ioloop import IOLoop
+
+from .buffers import utf8_boundary
+
+class OutputStream(object):
+    """Bounded buffer of output chunks with sequence numbers.
+
+    Chunks are numbered from one. When the total size of buffered
+    chunks exceeds ``max_size`` bytes, the oldest chunks are dropped,
+    so memory usage doesn't depend on how much an engine prints.
+    Clients that fall behind are told that they missed some output.
+    Pipes are read at arbitrary boundaries, so incomplete UTF-8 sequences
+    are held back until the rest of a character arrives.
+    """
+
+    def __init__(self, id, max_size):
+        self.ioloop = IOLoop.instance()
+
+        self.id = id
+        self.max_size = max_size
+
+        self.chunks = collections.deque()
+        self.size = 0
+        self.seq = 0
+
+        self.pending = {'out': '', 'err': ''}
+
+        self.finished = False
+        self.waiters = []
+
+    @property
+    def first(self):
+        """Sequence number of the oldest buffered chunk. """
+        if self.chunks:
+            return self.chunks[0][0]
+        else:
+            return self.seq + 1
+
+    def write(self, type, data):
+        """Append a chunk of ``stdout`` or ``stderr`` output. """
+        if self.finished:
+            return
+
+        data = self.pending[type] + data
+        end = utf8_boundary(data)
+
+        self.pending[type] = data[end:]
+        self._append(type, data[:end])
+
+    def _append(self, type, data):
+        """Append a chunk of complete UTF-8 characters. """
+        if not data:
+            return
+
+        data = data.decode('utf-8', 'replace')
+
+        self.seq += 1
+        self.size += len(data)
+        self.chunks.append((self.seq, type, data))
+
+        while self.size > self.max_size and len(self.chunks) > 1:
+            _, _, _data = self.chunks.popleft()
+            self.size -= len(_data)
+
+        self._notify()
+
+    def finish(self):
+        """Mark this stream as complete and wake up all clients. """
+        if self.finished:
+            return
+
+        for type, data in self.pending.items():
+            self.pending[type] = ''
+            self._append(type, data)
+
+        self.finished = True
+        self._notify()
+
+    def read(self, seq):
+        """Return all chunks newer than ``seq``. """
+        chunks = []
+
+        for _seq, type, data in self.chunks:
+            if _seq > seq:
+                chunks.append({'seq': _seq, 'type': type, 'data': data})
+
+        return {
+            'chunks': chunks,
+            'seq': self.seq,
+            'dropped': seq + 1 < self.first,
+            'finished': self.finished,
+        }
+
+    def wait(self, seq, callback, timeout):
+        """Call ``callback`` with chunks newer than ``seq`` (long-polling). """
+        if seq < self.seq or self.finished:
+            callback(self.read(seq))
+        else:
+            deadline = time.time() + timeout
+
+            def on_timeout():
+                self.waiters.remove(waiter)
+                callback(self.read(seq))
+
+            waiter = (seq, callback, self.ioloop.add_timeout(deadline, on_timeout))
+            self.waiters.append(waiter)
+
+    def _notify(self):
+        """Deliver new chunks to all waiting clients. """
+        waiters, self.waiters = self.waiters, []
+
+        for seq, callback, timeout in waiters:
+            self.ioloop.remove_timeout(timeout)
+            callback(self.read(seq))
@@ -0,0 +1,100 @@
+"""Tests for Online Lab SDK. """
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+
+from .models import User, Engine, Folder, Worksheet
+from .settings import defaults
+from .handlers.client import FolderAPIMixin, WorksheetAPIMixin, PatchError
+
+from ..utils.settings import Settings
+
+class FolderHandler(FolderAPIMixin):
+    """Call folder APIs directly, without a request. """
+
+    def __init__(self, user):
+        self.user = user
+        self.result = None
+
+    def return_api_result(self, result=None):
+        self.result = result
+
+    def return_api_error(self, reason=None):
+        self.result = {'ok': False, 'reason': reason}
+
+class WorksheetHandler(WorksheetAPIMixin, FolderHandler):
+    """Call worksheet APIs directly, without a request. """
+
+class FolderQueriesTestCase(TestCase):
+
+    def setUp(self):
+        self.debug, settings.DEBUG = settings.DEBUG, True
+        self.user = User.objects.create_user('test', 'test@example.com', 'test')
+        self.engine = Engine.objects.create(name='Python')
+
+    def tearDown(self):
+        settings.DEBUG = self.debug
+
+    def make_tree(self, depth, width, parent=None):
+        """Create ``depth`` levels of ``width`` folders, each with a worksheet. """
+        if depth:
+            for i in xrange(width):
+                folder = Folder.objects.create(user=self.user, name='F%d' % i, parent=parent)
+                Worksheet.objects.create(user=self.user, name='W%d' % i, folder=folder, engine=self.engine)
+                self.make_tree(depth-1, width, folder)
+
+    def count_queries(self, **params):
+        handler = FolderHandler(self.user)
+
+        start = len(connection.queries)
+        handler.RPC__Folder__getFolders(**params)
+        end = len(connection.queries)
+
+        self.assertTrue(handler.result.get('folders'))
+        return end - start
+
+    def test_get_folders(self):
+        self.make_tree(1, 2)
+        small = self.count_queries(worksheets=True)
+
+        self.make_tree(3, 3)
+        large = self.count_queries(worksheets=True)
+
+        self.assertEqual(small, large)
+        self.assertEqual(small, 2)
+
+class WorksheetPatchTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@example.com', 'test')
+        self.engine = Engine.objects.create(name='Python')
+        self.handler = WorksheetHandler(self.user)
+
+        # Patches invalidate the cache of published worksheets.
+        Settings.instance().setdefault('published_cache_size', defaults['published_cache_size'])
+
+    def make_worksheet(self, name):
+        return Worksheet.objects.create(user=self.user, name=name, engine=self.engine)
+
+    def patch(self, worksheet, *ops):
+        worksheet = Worksheet.objects.get(pk=worksheet.pk)
+        self.handler.RPC__Worksheet__patch(worksheet.uuid, worksheet.revision, list(ops))
+        return self.handler.result
+
+    def insert(self, uuid):
+        return {'op': 'insert', 'uuid': uuid, 'after': None, 'type': 'input', 'content': ''}
+
+    def test_insert_existing(self):
+        first, second = self.make_worksheet('A'), self.make_worksheet('B')
+        self.patch(first, self.insert('cell'))
+
+        self.assertRaises(PatchError, self.patch, first, self.insert('cell'))
+        self.assertRaises(PatchError, self.patch, second, self.insert('cell'))
+
+    def test_insert_deleted(self):
+        worksheet = self.make_worksheet('A')
+        self.patch(worksheet, self.insert('cell'))
+
+        result = self.patch(worksheet, {'op': 'delete', 'uuid': 'cell'}, self.insert('cell'))
+        self.assertEqual(result, {'revision': 2})
@@ -0,0 +1,296 @@
+"""Transports for communication between the SDK and engines. """
+
+import errno
+import socket
+import logging
+import xmlrpclib
+
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+from tornado.httputil import HTTPHeaders
+
+from . import utilities
+
+from ..engines.utils.framed import HEADER, encode_frame, decode_frame
+
+class HTTPConnection(object):
+    """Persistent HTTP/1.1 connection to an engine. """
+
+    def __init__(self, transport, sock):
+        self.transport = transport
+        self.pending = None
+
+        self.code = None
+        self.keep_alive = False
+
+        self.stream = IOStream(sock, IOLoop.instance())
+        self.stream.set_close_callback(self._on_close)
+
+    def request(self, body, callback, fail):
+        """Send a POST request and call ``callback(code, body)``. """
+        self.pending = (callback, fail)
+        self.code = None
+
+        headers = "POST / HTTP/1.1\r\n" \
+                  "Host: localhost\r\n" \
+                  "Content-Type: text/xml\r\n" \
+                  "Content-Length: %d\r\n\r\n" % len(body)
+
+        self.stream.write(headers + body)
+        self.stream.read_until("\r\n\r\n", self._on_headers)
+
+    def _on_headers(self, data):
+        status, _, data = data.partition("\r\n")
+
+        try:
+            version, code, _ = (status + ' ').split(' ', 2)
+            self.code = int(code)
+        except ValueError:
+            logging.error("HTTP transport: invalid status line '%s'" % status)
+            self.stream.close()
+            return
+
+        headers = HTTPHeaders.parse(data)
+
+        connection = headers.get('Connection', '').lower()
+
+        if version == 'HTTP/1.1':
+            self.keep_alive = connection != 'close'
+        else:
+            self.keep_alive = connection == 'keep-alive'
+
+        self.stream.read_bytes(int(headers.get('Content-Length', 0)), self._on_body)
+
+    def _on_body(self, data):
+        callback, _ = self.pending
+        self.pending = None
+
+        if self.keep_alive:
+            self.transport.release(self)
+        else:
+            self.close()
+
+        callback(self.code, data)
+
+    def _on_close(self):
+        """Fail pending request when connection is lost. """
+        self.transport.discard(self)
+
+        if self.pending is not None:
+            _, fail = self.pending
+            self.pending = None
+            fail('connection-closed')
+
+    def is_closed(self):
+        """Check (without blocking) if the engine closed this connection. """
+        if self.stream.closed():
+            return True
+
+        try:
+            self.stream.socket.recv(1, socket.MSG_PEEK)
+        except socket.error, exc:
+            return exc.args[0] not in (errno.EWOULDBLOCK, errno.EAGAIN)
+        else:
+            return True # EOF (or data nobody asked for)
+
+    def close(self):
+        """Close connection to an engine. """
+        self.stream.close()
+
+class XMLRPCTransport(object):
+    """XML-RPC over HTTP (with persistent connections).
+
+    Methods listed in ``idempotent`` are retried once if a reused
+    connection is closed before a response arrives. Others (notably
+    evaluation) may have already reached the engine, so they aren't.
+    """
+
+    max_idle = 4
+    idempotent = ['complete', 'skip']
+
+    def __init__(self, address):
+        self.address = address
+        self.idle = []
+        self.connections = set([])
+
+    def connect(self):
+        """Open a new connection to an engine (Unix socket or TCP port). """
+        if isinstance(self.address, int):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.connect(('localhost', self.address))
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.address)
+
+        sock.setblocking(0)
+
+        connection = HTTPConnection(self, sock)
+        self.connections.add(connection)
+
+        return connection
+
+    def release(self, connection):
+        """Return a connection to the pool of idle connections. """
+        if len(self.idle) < self.max_idle:
+            self.idle.append(connection)
+        else:
+            connection.close()
+
+    def discard(self, connection):
+        """Forget a connection that was closed. """
+        self.connections.discard(connection)
+
+        try:
+            self.idle.remove(connection)
+        except ValueError:
+            pass
+
+    def call(self, method, params, okay, fail):
+        """Call ``method`` in an engine asynchronously. """
+        body = utilities.xml_encode(params, method)
+
+        def on_response(code, body):
+            if code == 200:
+                try:
+                    result = utilities.xml_decode(body)
+                except xmlrpclib.Fault, exc:
+                    fail('fault: %s' % exc)
+                else:
+                    okay(result)
+            else:
+                fail('response-code: %s' % code)
+
+        self._request(body, on_response, fail, method in self.idempotent)
+
+    def _get_idle(self):
+        """Return an idle connection that wasn't closed by the engine. """
+        while self.idle:
+            connection = self.idle.pop()
+
+            if not connection.is_closed():
+                return connection
+
+            connection.close()
+
+        return None
+
+    def _request(self, body, callback, fail, retry, stale=None):
+        """Send a request over an idle (or a new) connection.
+
+        Idle connections that the engine closed are dropped first. The
+        engine might still close a connection just when it's reused, so
+        if ``retry`` is set and it gets closed before any response
+        arrives, the request is sent once again over a new connection.
+        """
+        if stale is None:
+            connection = self._get_idle()
+        else:
+            connection = None
+
+        if connection is not None:
+            reused = True
+        else:
+            try:
+                connection, reused = self.connect(), False
+            except socket.error, exc:
+                fail(stale or 'connect: %s' % exc)
+                return
+
+        def on_fail(error):
+            if retry and reused and stale is None and connection.code is None:
+                self._request(body, callback, fail, retry, error)
+            else:
+                fail(error)
+
+        connection.request(body, callback, on_fail)
+
+    def close(self):
+        """Close all connections to an engine. """
+        for connection in list(self.connections):
+            connection.close()
+
+class FramedTransport(object):
+    """Length-prefixed JSON frames over a persistent Unix socket. """
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = None
+        self.pending = {}
+        self.id = 0
+
+    def connect(self):
+        """Open a persistent connection to an engine. """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.setblocking(0)
+
+        self.stream = IOStream(sock, IOLoop.instance())
+        self.stream.set_close_callback(self._on_close)
+
+        self._read_header()
+
+    def call(self, method, params, okay, fail):
+        """Call ``method`` in an engine asynchronously. """
+        if self.stream is None:
+            try:
+                self.connect()
+            except socket.error, exc:
+                fail('connect: %s' % exc)
+                return
+
+        self.id += 1
+        self.pending[self.id] = (okay, fail)
+
+        self.stream.write(encode_frame({'id': self.id, 'method': method, 'params': [params]}))
+
+    def _read_header(self):
+        self.stream.read_bytes(HEADER.size, self._on_header)
+
+    def _on_header(self, data):
+        size, = HEADER.unpack(data)
+        self.stream.read_bytes(size, self._on_frame)
+
+    def _on_frame(self, data):
+        self._read_header()
+
+        try:
+            response = decode_frame(data)
+        except ValueError:
+            logging.error("Framed transport: invalid frame from %s" % self.path)
+            return
+
+        try:
+            okay, fail = self.pending.pop(response.get('id'))
+        except KeyError:
+            logging.warning("Framed transport: unexpected response from %s" % self.path)
+            return
+
+        error = response.get('error')
+
+        if error is not None:
+            fail('fault: %s' % error)
+        else:
+            okay(response.get('result'))
+
+    def _on_close(self):
+        """Fail all pending calls when connection is lost. """
+        pending, self.pending = self.pending, {}
+        self.stream = None
+
+        for okay, fail in pending.itervalues():
+            fail('connection-closed')
+
+    def close(self):
+        """Close connection to an engine. """
+        if self.stream is not None:
+            self.stream.close()
+
+transports = {
+    'xmlrpc': XMLRPCTransport,
+    'framed': FramedTransport,
+}
+
+def get_transport(name, address):
+    """Construct transport ``name`` for the given engine ``address``. """
+    return transports[name](address)
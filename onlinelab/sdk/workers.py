@@ -0,0 +1,190 @@
+"""Pool of processes for rendering with Pygments and Docutils. """
+
+import time
+import signal
+import logging
+import traceback
+import multiprocessing
+
+from tornado.ioloop import IOLoop
+
+from .highlight import Highlight
+from .metrics import Histogram
+
+from ..utils.settings import Settings
+from ..utils.cache import LRUCache, content_key
+
+def _init_worker():
+    """Leave handling of SIGINT to the SDK process. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # SDK workers raise KeyboardInterrupt on SIGTERM, but terminate() must just kill.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def _render(jobs):
+    """Run rendering jobs (``{key: (kind, text)}``) and time them. """
+    start = time.time()
+
+    hl = Highlight()
+    results = {}
+
+    for key, (kind, text) in jobs.iteritems():
+        try:
+            results[key] = getattr(hl, kind)(text)
+        except Exception:
+            traceback.print_exc()
+            results[key] = None
+
+    return results, time.time() - start
+
+class RenderJob(object):
+    """Rendering jobs waiting for results from the pool. """
+
+    def __init__(self, jobs, callback):
+        self.jobs = jobs
+        self.callback = callback
+        self.queued = time.time()
+        self.timeout = None
+
+class RenderPool(object):
+    """Render text outside the IOLoop, in a pool of processes.
+
+    Pygments and Docutils are pure Python and fairly slow, so rendering
+    a large docstring or traceback in the IOLoop would delay requests
+    of all other users. Jobs are sent to ``render_workers`` processes
+    (threads wouldn't help because of the GIL) and callbacks are run
+    in the IOLoop when results arrive. With no workers (or if the pool
+    can't take jobs), jobs are run synchronously. If results don't
+    arrive within ``render_timeout`` seconds (e.g. a worker was killed,
+    which :mod:`multiprocessing` doesn't report), callbacks get no HTML
+    for the missing jobs, like for jobs that failed.
+
+    The same docstrings and tracebacks are rendered over and over, so
+    results are cached (by hash of their kind and text) in this process
+    and shared by all engines.
+    """
+
+    def __init__(self):
+        self.settings = Settings.instance()
+        self.ioloop = IOLoop.instance()
+
+        self.pool = None
+        self.cache = LRUCache(self.settings.render_cache_size)
+
+        self.pending = 0
+        self.pending_max = 0
+        self.rendered = 0
+        self.timeouted = 0
+
+        self.render_time = Histogram()
+        self.wait_time = Histogram()
+
+    @classmethod
+    def instance(cls):
+        """Returns the global :class:`RenderPool` instance. """
+        if not hasattr(cls, '_instance'):
+            cls._instance = cls()
+        return cls._instance
+
+    def start(self):
+        """Start worker processes (before engines, so they don't inherit them). """
+        size = self.settings.render_workers
+
+        if size > 0:
+            self.pool = multiprocessing.Pool(size, _init_worker)
+            logging.info("Started %d render worker(s)" % size)
+
+    def stop(self):
+        """Terminate worker processes. """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def render(self, jobs, callback):
+        """Render ``{key: (kind, text)}`` jobs and pass ``{key: html}`` to ``callback``. """
+        results, missing, keys = {}, {}, {}
+
+        for key, (kind, text) in jobs.iteritems():
+            keys[key] = content_key(kind, text)
+            html = self.cache.get(keys[key])
+
+            if html is not None:
+                results[key] = html
+            else:
+                missing[key] = (kind, text)
+
+        def _okay(rendered):
+            for key, html in rendered.iteritems():
+                if html is not None:
+                    self.cache.put(keys[key], html, len(html))
+
+            results.update(rendered)
+            callback(results)
+
+        if not missing:
+            callback(results)
+        elif self.pool is None:
+            self._render_inline(missing, _okay)
+        else:
+            job = RenderJob(missing, _okay)
+
+            def _done(outcome):
+                # Called in a thread of the pool, so get back to the IOLoop.
+                self.ioloop.add_callback(lambda: self._on_done(job, outcome))
+
+            try:
+                self.pool.apply_async(_render, (missing,), callback=_done)
+            except (ValueError, AssertionError):
+                logging.warning("Render pool is not running, rendering inline")
+                self._render_inline(missing, _okay)
+                return
+
+            self.pending += 1
+            self.pending_max = max(self.pending, self.pending_max)
+
+            deadline = job.queued + self.settings.render_timeout
+            job.timeout = self.ioloop.add_timeout(deadline, lambda: self._on_timeout(job))
+
+    def _render_inline(self, jobs, callback):
+        rendered, elapsed = _render(jobs)
+        self.render_time.add(elapsed)
+        self.rendered += 1
+        callback(rendered)
+
+    def _on_done(self, job, outcome):
+        if job.timeout is None:
+            return # already reported as not rendered
+
+        self.ioloop.remove_timeout(job.timeout)
+        job.timeout = None
+
+        rendered, elapsed = outcome
+
+        self.pending -= 1
+        self.rendered += 1
+
+        self.render_time.add(elapsed)
+        self.wait_time.add(max(time.time() - job.queued - elapsed, 0.0))
+
+        job.callback(rendered)
+
+    def _on_timeout(self, job):
+        job.timeout = None
+
+        self.pending -= 1
+        self.timeouted += 1
+
+        logging.warning("Rendering took longer than %s seconds" % self.settings.render_timeout)
+        job.callback(dict.fromkeys(job.jobs))
+
+    def get_stat(self):
+        """Return queue length and timings of rendering. """
+        return {
+            'workers': self.settings.render_workers,
+            'pending': self.pending,
+            'pending_max': self.pending_max,
+            'rendered': self.rendered,
+            'timeouted': self.timeouted,
+            'render_time': self.render_time.get_stat(),
+            'wait_time': self.wait_time.get_stat(),
+            'cache': self.cache.get_stat(),
+        }
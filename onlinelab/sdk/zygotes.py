@@ -0,0 +1,392 @@
+"""Fork servers (zygotes) for fast spawning of engine processes. """
+
+import os
+import re
+import time
+import json
+import errno
+import signal
+import socket
+import select
+import shutil
+import logging
+
+from subprocess import Popen, PIPE
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from ..utils.settings import Settings
+
+class ForkedProcess(object):
+    """:class:`Popen`-like handle of a process spawned by a zygote.
+
+    The process is a child of a zygote, not of this process, so we
+    can't wait for it directly. The zygote reaps it and reports its
+    exit status, which sets :attr:`returncode`.
+    """
+
+    def __init__(self, zygote, pid, stdout, stderr):
+        self.zygote = zygote
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.orphaned = False
+
+    def exited(self, returncode):
+        """Record exit status reported by the zygote. """
+        self.returncode = returncode
+
+    def poll(self):
+        """Check if the process has terminated. """
+        if self.returncode is None and self.orphaned:
+            # The zygote died, so nobody will report the exit status.
+            try:
+                os.kill(self.pid, 0)
+            except OSError as exc:
+                if exc.errno == errno.ESRCH:
+                    self.returncode = -1
+
+        return self.returncode
+
+    def wait(self, timeout=1.0):
+        """Wait (a short while) for the process to terminate. """
+        deadline = time.time() + timeout
+
+        while self.poll() is None and time.time() < deadline:
+            if not self.zygote.read_status(deadline - time.time()):
+                time.sleep(0.01)
+
+        return self.returncode
+
+    def send_signal(self, sig):
+        """Send a signal to the process. """
+        if self.returncode is not None:
+            return # reaped, so the PID may belong to someone else now
+
+        try:
+            os.kill(self.pid, sig)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+    def terminate(self):
+        """Terminate the process with SIGTERM. """
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        """Kill the process with SIGKILL. """
+        self.send_signal(signal.SIGKILL)
+
+class Zygote(object):
+    """Fork server process of a single engine type.
+
+    A zygote writes one line per event to its ``stdout``: ``OK`` when
+    it's ready and ``EXIT`` with a PID and an exit status whenever it
+    reaps a child. A zygote that died is restarted after a delay, which
+    doubles with each consecutive failure.
+    """
+
+    _re_ok = re.compile(r"^OK \(pid=(?P<pid>\d+)\)$")
+    _re_exit = re.compile(r"^EXIT \(pid=(?P<pid>\d+), code=(?P<code>-?\d+)\)$")
+
+    min_restart_delay = 1
+    max_restart_delay = 60
+
+    def __init__(self, name):
+        self.settings = Settings.instance()
+        self.ioloop = IOLoop.instance()
+
+        self.name = name
+        self.process = None
+        self.ready = False
+        self.stopped = False
+
+        self.output = ''
+        self.children = {}
+        self.statuses = {}
+
+        self.restart_delay = self.min_restart_delay
+
+        # Each SDK worker process has its own fork servers.
+        self.cwd = os.path.join(self.settings.data_path, 'zygote-%s-%d' % (name, os.getpid()))
+        self.path = os.path.join(self.cwd, 'zygote.sock')
+
+    @property
+    def manager(self):
+        from .processes import ProcessManager
+        return ProcessManager.instance()
+
+    @property
+    def pid(self):
+        if self.process is not None:
+            return self.process.pid
+        else:
+            return None
+
+    def start(self):
+        """Start a fork server process. """
+        from .runner import build_env
+
+        if self.stopped:
+            return
+
+        namespace = {}
+
+        try:
+            exec "from onlinelab.engines.%s import zygote_builder" % self.name in namespace
+        except ImportError:
+            logging.warning("Engine '%s' doesn't support fork server" % self.name)
+            return
+
+        if os.path.exists(self.cwd):
+            shutil.rmtree(self.cwd)
+
+        os.mkdir(self.cwd)
+
+        command = namespace['zygote_builder'](self.path)
+        env = build_env(self.settings, self.cwd)
+
+        self.output = ''
+        self.statuses = {}
+
+        try:
+            self.process = Popen(command, cwd=self.cwd, env=env,
+                close_fds=True, stdin=PIPE, stdout=PIPE, stderr=None)
+        except (IOError, OSError) as exc:
+            logging.error("Can't start fork server of '%s' engine (%s)" % (self.name, exc))
+            self._schedule_restart()
+            return
+
+        self.manager.track(self.process.pid)
+
+        iomask = self.ioloop.READ | self.ioloop.ERROR
+        self.ioloop.add_handler(self.process.stdout.fileno(), self._on_pipe, iomask)
+
+    def _schedule_restart(self):
+        """Start the fork server again after a delay. """
+        if self.stopped:
+            return
+
+        logging.info("Restarting fork server of '%s' engine in %s s" % (self.name, self.restart_delay))
+
+        self.ioloop.add_timeout(time.time() + self.restart_delay, self.start)
+        self.restart_delay = min(2*self.restart_delay, self.max_restart_delay)
+
+    def _on_pipe(self, fd, events):
+        """Gets executed when a zygote communicates with us. """
+        if events & self.ioloop.READ:
+            self._read_pipe(fd)
+
+        if events & self.ioloop.ERROR:
+            self.ioloop.remove_handler(fd)
+            self.ready = False
+
+            self.process.wait()
+            self.manager.untrack(self.process.pid)
+
+            logging.warning("Fork server of '%s' engine died (code=%s)" % (self.name, self.process.returncode))
+
+            children, self.children = self.children, {}
+
+            for child in children.itervalues():
+                child.orphaned = True
+
+            self._schedule_restart()
+
+    def _read_pipe(self, fd):
+        """Read and process available output of the zygote. """
+        try:
+            data = os.read(fd, 4096)
+        except OSError as exc:
+            if exc.errno in (errno.EAGAIN, errno.EINTR):
+                return False
+            raise
+
+        self.output += data
+
+        while '\n' in self.output:
+            line, self.output = self.output.split('\n', 1)
+            self._on_line(line)
+
+        return bool(data)
+
+    def _on_line(self, line):
+        """Process a single line of output of the zygote. """
+        result = self._re_exit.match(line)
+
+        if result is not None:
+            child = self.children.pop(int(result.group('pid')), None)
+
+            if child is not None:
+                child.exited(int(result.group('code')))
+            else:
+                # Reaped before we got the reply to spawn request.
+                self.statuses[int(result.group('pid'))] = int(result.group('code'))
+
+            return
+
+        if not self.ready and self._re_ok.match(line):
+            self.ready = True
+            self.restart_delay = self.min_restart_delay
+            logging.info("Started fork server of '%s' engine (pid=%s)" % (self.name, self.pid))
+
+    def read_status(self, timeout):
+        """Wait at most ``timeout`` seconds for output of the zygote. """
+        if self.process is None or not self.ready:
+            return False
+
+        fd = self.process.stdout.fileno()
+
+        try:
+            readable, _, _ = select.select([fd], [], [], max(timeout, 0))
+        except select.error:
+            return False
+
+        if readable:
+            return self._read_pipe(fd)
+        else:
+            return False
+
+    def spawn(self, cwd, env, run, limits, okay, fail):
+        """Fork a new engine process in ``cwd`` with environment ``env``.
+
+        The reply from the zygote is awaited asynchronously, then either
+        ``okay(process)`` or ``fail(error)`` is called.
+        """
+        if not self.ready:
+            fail('not-ready')
+            return
+
+        stdout_path = os.path.join(cwd, '.stdout')
+        stderr_path = os.path.join(cwd, '.stderr')
+
+        os.mkfifo(stdout_path, 0600)
+        os.mkfifo(stderr_path, 0600)
+
+        # Open our ends of the FIFOs before the zygote opens its ends,
+        # otherwise the zygote would block forever in open(2).
+
+        stdout = os.fdopen(os.open(stdout_path, os.O_RDONLY | os.O_NONBLOCK), 'r')
+        stderr = os.fdopen(os.open(stderr_path, os.O_RDONLY | os.O_NONBLOCK), 'r')
+
+        request = json.dumps({
+            'cwd': cwd,
+            'env': env,
+            'run': run,
+            'limits': limits,
+            'stdout': stdout_path,
+            'stderr': stderr_path,
+        })
+
+        state = {'done': False, 'timeout': None}
+
+        def _fail(error):
+            if state['done']:
+                return
+
+            state['done'] = True
+
+            try:
+                self.ioloop.remove_timeout(state['timeout'])
+            except ValueError:
+                pass # we are in the timeout handler
+
+            stream.close()
+            stdout.close()
+            stderr.close()
+            os.unlink(stdout_path)
+            os.unlink(stderr_path)
+            fail('spawn-failed: %s' % error)
+
+        def _on_reply(data):
+            try:
+                pid = json.loads(data)['pid']
+            except (ValueError, KeyError, TypeError):
+                _fail('invalid reply')
+                return
+
+            state['done'] = True
+
+            self.ioloop.remove_timeout(state['timeout'])
+            stream.close()
+
+            process = ForkedProcess(self, pid, stdout, stderr)
+
+            if pid in self.statuses:
+                process.exited(self.statuses.pop(pid))
+            else:
+                self.children[pid] = process
+
+            okay(process)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            sock.connect(self.path)
+        except socket.error as exc:
+            sock.close()
+            stream = None
+            stdout.close()
+            stderr.close()
+            os.unlink(stdout_path)
+            os.unlink(stderr_path)
+            fail('spawn-failed: %s' % exc)
+            return
+
+        sock.setblocking(0)
+
+        stream = IOStream(sock, self.ioloop)
+        stream.set_close_callback(lambda: _fail('connection closed'))
+
+        deadline = time.time() + self.settings.engine_timeout
+        state['timeout'] = self.ioloop.add_timeout(deadline, lambda: _fail('timeout'))
+
+        stream.write(request + '\n')
+        stream.read_until('\n', _on_reply)
+
+    def kill(self):
+        """Kill the fork server process (and don't restart it). """
+        self.stopped = True
+
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.manager.untrack(self.process.pid)
+
+class Zygotes(object):
+    """Collection of fork servers, one per engine type. """
+
+    def __init__(self):
+        self.settings = Settings.instance()
+        self.zygotes = {}
+
+    @classmethod
+    def instance(cls):
+        """Returns the global :class:`Zygotes` instance. """
+        if not hasattr(cls, '_instance'):
+            cls._instance = cls()
+        return cls._instance
+
+    def start(self):
+        """Start fork servers for all configured engine types. """
+        for name in self.settings.fork_engines:
+            if name not in self.settings.engines:
+                logging.warning("Can't fork unknown engine '%s'" % name)
+                continue
+
+            zygote = self.zygotes[name] = Zygote(name)
+            zygote.start()
+
+    def get(self, name):
+        """Return a ready fork server for ``name`` engine or ``None``. """
+        zygote = self.zygotes.get(name)
+
+        if zygote is not None and zygote.ready:
+            return zygote
+        else:
+            return None
+
+    def killall(self):
+        """Forcibly kill all fork servers. """
+        for zygote in self.zygotes.itervalues():
+            zygote.kill()
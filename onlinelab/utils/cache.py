@@ -0,0 +1,97 @@
+"""Size-bounded caches. """
+
+import hashlib
+import collections
+
+def content_key(*parts):
+    """Return a compact key identifying (possibly large) text ``parts``. """
+    digest = hashlib.sha1()
+
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+
+        digest.update(part)
+        digest.update('\0')
+
+    return digest.digest()
+
+class LRUCache(object):
+    """Least recently used cache bounded by total size of values in bytes. """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Return a cached value and mark it as recently used. """
+        try:
+            value, size = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        else:
+            self.entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size):
+        """Store ``value`` of ``size`` bytes, evicting old values if needed. """
+        if size > self.max_size:
+            return
+
+        try:
+            _, _size = self.entries.pop(key)
+        except KeyError:
+            pass
+        else:
+            self.size -= _size
+
+        self.entries[key] = (value, size)
+        self.size += size
+
+        while self.size > self.max_size:
+            _, (_, _size) = self.entries.popitem(last=False)
+            self.size -= _size
+            self.evictions += 1
+
+    def discard(self, key):
+        """Remove a value (if present). """
+        try:
+            _, size = self.entries.pop(key)
+        except KeyError:
+            pass
+        else:
+            self.size -= size
+
+    def clear(self):
+        """Remove all values. """
+        self.entries.clear()
+        self.size = 0
+
+    def get_stat(self):
+        """Return hit rate and occupancy of this cache. """
+        lookups = self.hits + self.misses
+
+        if lookups:
+            hit_rate = float(self.hits)/lookups
+        else:
+            hit_rate = None
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'size': self.size,
+            'max_size': self.max_size,
+        }
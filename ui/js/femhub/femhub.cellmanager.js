@@ -4,6 +4,8 @@ FEMhub.CellManager = Ext.extend(Ext.util.Observable, {
     statusSaved: true,
     evalIndex: 1,
     activeCell: null,
+    revision: null,
+    savedState: null,
 
     types: {
         text: 'TextCell',
@@ -398,6 +400,29 @@ FEMhub.CellManager = Ext.extend(Ext.util.Observable, {
         case 'bad-engine':
             msg = "Invalid or misconfigured engine.";
             break;
+        case 'memory-limit':
+            msg = "Engine was killed, because it exceeded its memory limit.";
+            break;
+        case 'cpu-limit':
+            msg = "Engine was killed, because it exceeded its CPU time limit.";
+            break;
+        case 'evicted':
+            this.isInitialized = false;
+
+            Ext.MessageBox.show({
+                title: 'Engine stopped',
+                msg: 'Engine was stopped to free resources and its state was lost. Do you want to start a new engine?',
+                buttons: Ext.MessageBox.YESNO,
+                icon: Ext.MessageBox.QUESTION,
+                fn: function(button) {
+                    if (button === 'yes') {
+                        this.initEngine();
+                    }
+                },
+                scope: this,
+            });
+
+            return;
         default:
             msg = error;
         }
@@ -408,6 +433,9 @@ FEMhub.CellManager = Ext.extend(Ext.util.Observable, {
     loadCells: function() {
         FEMhub.RPC.Worksheet.load({uuid: this.uuid}, {
             okay: function(result) {
+                this.revision = result.revision;
+                this.savedState = this.getState(result.cells);
+
                 if (result.cells.length === 0) {
                     if (this.startEmpty !== false) {
                         this.newCell({
@@ -454,6 +482,79 @@ FEMhub.CellManager = Ext.extend(Ext.util.Observable, {
         });
     },
 
+    getState: function(cells) {
+        var state = {order: [], cells: {}};
+
+        Ext.each(cells, function(data) {
+            state.order.push(data.uuid);
+
+            state.cells[data.uuid] = {
+                content: data.content,
+                type: data.type,
+                collapsed: data.collapsed,
+            };
+        });
+
+        return state;
+    },
+
+    getPatch: function(data) {
+        var state = this.savedState, ops = [];
+        var current = {}, order = [];
+
+        Ext.each(data, function(cell) {
+            current[cell.uuid] = cell;
+        });
+
+        Ext.each(state.order, function(uuid) {
+            if (Ext.isDefined(current[uuid])) {
+                order.push(uuid);
+            } else {
+                ops.push({op: 'delete', uuid: uuid});
+            }
+        });
+
+        Ext.each(data, function(cell, i) {
+            var after = (i === 0) ? null : data[i-1].uuid;
+            var saved = state.cells[cell.uuid];
+
+            if (!Ext.isDefined(saved)) {
+                ops.push({
+                    op: 'insert',
+                    uuid: cell.uuid,
+                    after: after,
+                    content: cell.content,
+                    type: cell.type,
+                    collapsed: cell.collapsed,
+                });
+
+                order.splice(i, 0, cell.uuid);
+            } else {
+                if (order[i] !== cell.uuid) {
+                    ops.push({op: 'move', uuid: cell.uuid, after: after});
+
+                    order.remove(cell.uuid);
+                    order.splice(i, 0, cell.uuid);
+                }
+
+                var op = {op: 'update', uuid: cell.uuid}, changed = false;
+
+                Ext.each(['content', 'type', 'collapsed'], function(field) {
+                    if (saved[field] !== cell[field]) {
+                        op[field] = cell[field];
+                        changed = true;
+                    }
+                });
+
+                if (changed) {
+                    ops.push(op);
+                }
+            }
+        });
+
+        return ops;
+    },
+
     saveCells: function(handler, scope) {
         var cells = [], data = [];
 
@@ -468,32 +569,60 @@ FEMhub.CellManager = Ext.extend(Ext.util.Observable, {
             });
         }, this);
 
-        var params = {uuid: this.uuid, cells: data};
+        function saved(result) {
+            this.revision = result.revision;
+            this.savedState = this.getState(data);
 
-        FEMhub.RPC.Worksheet.save(params, {
-            okay: function(result) {
-                Ext.each(cells, function(cell) {
-                    cell.saved = true;
-                });
+            Ext.each(cells, function(cell) {
+                cell.saved = true;
+            });
 
-                this.statusSaved = true;
+            this.statusSaved = true;
 
-                if (Ext.isDefined(handler)) {
-                    handler.call(scope || this);
-                }
+            if (Ext.isDefined(handler)) {
+                handler.call(scope || this);
+            }
+        }
+
+        var status = {
+            start: function() {
+                return this.fireEvent('savestart', this);
             },
-            fail: function(reason, result) {
-                // TODO
+            end: function(ok, ret) {
+                this.fireEvent('saveend', this, ok, ret);
             },
-            scope: this,
-            status: {
-                start: function() {
-                    return this.fireEvent('savestart', this);
-                },
-                end: function(ok, ret) {
-                    this.fireEvent('saveend', this, ok, ret);
+        };
+
+        function save() {
+            FEMhub.RPC.Worksheet.save({uuid: this.uuid, cells: data}, {
+                okay: saved,
+                fail: function(reason, result) {
+                    // TODO
                 },
+                scope: this,
+                status: status,
+            });
+        }
+
+        if (this.savedState === null || this.revision === null) {
+            save.call(this);
+            return;
+        }
+
+        var ops = this.getPatch(data);
+
+        if (ops.length === 0) {
+            saved.call(this, {revision: this.revision});
+            return;
+        }
+
+        FEMhub.RPC.Worksheet.patch({uuid: this.uuid, revision: this.revision, ops: ops}, {
+            okay: saved,
+            fail: function(reason, result) {
+                save.call(this); // e.g. 'stale-revision', so overwrite everything
             },
+            scope: this,
+            status: status,
         });
     },
 